@@ -1,4 +1,4 @@
-from .stability_api import StabilityConservativeUpscale, StabilityCreativeUpscale, StabilityRemoveBackground, StabilityInpainting, StabilityErase, StabilityCore, StabilityImageUltra, StabilitySearchAndReplace, StabilityOutpainting, StabilitySD3, StabilityControlSketch, StabilityControlStructure, StabilitySearchAndRecolor, StabilityControlStyle, StabilityFastUpscale, StabilityReplaceRelight
+from .stability_api import StabilityConservativeUpscale, StabilityCreativeUpscale, StabilityRemoveBackground, StabilityInpainting, StabilityErase, StabilityCore, StabilityImageUltra, StabilitySearchAndReplace, StabilityOutpainting, StabilitySD3, StabilityControlSketch, StabilityControlStructure, StabilitySearchAndRecolor, StabilityControlStyle, StabilityFastUpscale, StabilityReplaceRelight, StabilityCreativeUpscaleSubmit, StabilityReplaceRelightSubmit, StabilityConservativeUpscaleToFile, StabilityFastUpscaleToFile, StabilityFetchResult, StabilityFetchResultToFile, StabilityLoadImageFile, StabilitySweep
 
 NODE_CLASS_MAPPINGS = {
     "Stability Conservative Upscale": StabilityConservativeUpscale,
@@ -17,4 +17,12 @@ NODE_CLASS_MAPPINGS = {
     "Stability Control Style": StabilityControlStyle,
     "Stability Fast Upscale": StabilityFastUpscale,
     "Stability Replace Background and Relight": StabilityReplaceRelight,
+    "Stability Creative Upscale (Submit)": StabilityCreativeUpscaleSubmit,
+    "Stability Replace Background and Relight (Submit)": StabilityReplaceRelightSubmit,
+    "Stability Conservative Upscale (To File)": StabilityConservativeUpscaleToFile,
+    "Stability Fast Upscale (To File)": StabilityFastUpscaleToFile,
+    "Stability Fetch Result": StabilityFetchResult,
+    "Stability Fetch Result To File": StabilityFetchResultToFile,
+    "Stability Load Image File": StabilityLoadImageFile,
+    "Stability Sweep": StabilitySweep,
 }
@@ -0,0 +1,40 @@
+import argparse
+import time
+
+from common import load_package, make_image
+
+load_package()
+from sai_api.encoder import encode_image
+from sai_api.stability_api import StabilityConservativeUpscale, StabilityRemoveBackground, StabilitySD3
+from sai_api.tiling import resize
+
+NODES = [StabilitySD3, StabilityConservativeUpscale, StabilityRemoveBackground]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Upload bytes and time saved by downscaling inputs to each endpoint's useful size")
+    parser.add_argument("--width", type=int, default=4896)
+    parser.add_argument("--height", type=int, default=3264)
+    parser.add_argument("--mbps", type=float, default=100.0, help="uplink bandwidth used to estimate upload time")
+    args = parser.parse_args()
+
+    image = make_image(args.height, args.width)
+    start = time.perf_counter()
+    full = encode_image(image)
+    full_encode = time.perf_counter() - start
+    full_upload = len(full) * 8 / (args.mbps * 1e6)
+    print(f"input {args.width}x{args.height}: {len(full):,} bytes, encode {full_encode:.3f}s, upload {full_upload:.3f}s at {args.mbps:g} Mbit/s")
+    print(f"{'endpoint':<36}{'size':>12}{'bytes':>14}{'resize+encode':>15}{'upload':>9}{'saved':>9}")
+
+    for node in NODES:
+        h, w = node.CAPABILITIES.fit(args.height, args.width, useful=True)
+        start = time.perf_counter()
+        small = encode_image(resize(image, h, w))
+        seconds = time.perf_counter() - start
+        upload = len(small) * 8 / (args.mbps * 1e6)
+        saved = (full_encode + full_upload) - (seconds + upload)
+        print(f"{node.API_ENDPOINT:<36}{f'{w}x{h}':>12}{len(small):>14,}{seconds:>14.3f}s{upload:>8.3f}s{saved:>8.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+import argparse
+from io import BytesIO
+
+from torchvision.transforms import ToPILImage
+
+from common import load_package, make_image, timed
+
+load_package()
+from sai_api.encoder import encode_image
+
+SIZES = {"1k": (1024, 1024), "2k": (2048, 2048), "4k": (2160, 3840)}
+
+
+def legacy(image):
+    buffered = BytesIO()
+    ToPILImage()(image.squeeze(0).permute(2, 0, 1)).save(buffered, format="PNG")
+    return buffered.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the upload encoder against ToPILImage + default PNG")
+    parser.add_argument("--sizes", default="1k,2k,4k")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    variants = [
+        ("legacy ToPILImage+png", legacy),
+        ("png level 1", lambda t: encode_image(t, "png", 1)),
+        ("webp lossless", lambda t: encode_image(t, "webp", 0)),
+        ("jpeg q95", lambda t: encode_image(t, "jpeg", quality=95)),
+    ]
+    print(f"{'size':<6}{'variant':<24}{'seconds':>10}{'bytes':>14}")
+    for name in args.sizes.split(","):
+        h, w = SIZES[name]
+        image = make_image(h, w)
+        for label, fn in variants:
+            seconds, size = timed(lambda: fn(image), args.repeat)
+            print(f"{name:<6}{label:<24}{seconds:>10.3f}{size:>14,}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+import argparse
+import os
+import subprocess
+import sys
+
+from common import ROOT
+
+HEAVY_MODULES = ("torch", "torchvision", "numpy", "PIL", "requests", "urllib3")
+
+# Mirrors what ComfyUI does at startup: import the package and read the node mappings
+SNIPPET = f"""
+import sys, time
+sys.path.insert(0, {os.path.join(ROOT, "benchmarks")!r})
+from common import load_package
+start = time.perf_counter()
+load_package().NODE_CLASS_MAPPINGS
+print((time.perf_counter() - start) * 1000)
+"""
+
+
+def measure():
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", SNIPPET], capture_output=True, text=True)
+    if result.returncode != 0:
+        raise SystemExit(result.stderr)
+
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules[name.strip()] = int(cumulative_us)
+    return float(result.stdout.strip()), modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure what registering the nodes imports, using python -X importtime")
+    parser.add_argument("--max-ms", type=float, default=100.0, help="fail if the package import takes longer than this")
+    args = parser.parse_args()
+
+    package_ms, modules = measure()
+    heavy = sorted(m for m in modules if m.split(".")[0] in HEAVY_MODULES)
+
+    print(f"package import: {package_ms:.1f} ms")
+    for name, us in sorted(modules.items(), key=lambda item: -item[1])[:10]:
+        print(f"  {us / 1000:8.1f} ms  {name}")
+
+    failed = False
+    if heavy:
+        print(f"FAIL: heavy modules imported at registration: {', '.join(heavy)}")
+        failed = True
+    if package_ms > args.max_ms:
+        print(f"FAIL: package import took {package_ms:.1f} ms, limit is {args.max_ms:.1f} ms")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
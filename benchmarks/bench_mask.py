@@ -0,0 +1,53 @@
+import argparse
+from io import BytesIO
+
+import torch
+from torchvision.transforms import ToPILImage
+
+from common import load_package, timed
+
+load_package()
+from sai_api.encoder import encode_mask
+
+SIZES = {"2k": (2048, 2048), "4k": (2160, 3840)}
+
+
+def legacy(mask):
+    mask = mask.reshape((-1, 1, mask.shape[-2], mask.shape[-1])).movedim(1, -1).expand(-1, -1, -1, 3)
+    mask = ToPILImage()(mask.squeeze(0).permute(2, 0, 1))
+    buffered = BytesIO()
+    mask.save(buffered, format="PNG")
+    return buffered.getvalue()
+
+
+def make_mask(h, w):
+    # A few soft edged blobs, like a painted inpainting mask
+    y = torch.linspace(0, 1, h)[:, None]
+    x = torch.linspace(0, 1, w)[None, :]
+    mask = torch.zeros(h, w)
+    for cy, cx, r in ((0.3, 0.3, 0.15), (0.6, 0.7, 0.2), (0.8, 0.2, 0.1)):
+        d = ((y - cy) ** 2 + (x - cx) ** 2).sqrt()
+        mask = torch.maximum(mask, ((r - d) / 0.02).clamp(0, 1))
+    return mask[None]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare single channel mask encoding against the RGB ToPILImage path")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    variants = [
+        ("legacy RGB png", legacy),
+        ("L png level 1", lambda m: encode_mask(m, bits=8)),
+        ("1-bit png level 1", lambda m: encode_mask(m, bits=1)),
+    ]
+    print(f"{'size':<6}{'variant':<22}{'seconds':>10}{'bytes':>12}")
+    for name, (h, w) in SIZES.items():
+        mask = make_mask(h, w)
+        for label, fn in variants:
+            seconds, size = timed(lambda: fn(mask), args.repeat)
+            print(f"{name:<6}{label:<22}{seconds:>10.3f}{size:>12,}")
+
+
+if __name__ == "__main__":
+    main()
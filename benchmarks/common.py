@@ -0,0 +1,37 @@
+import importlib.util
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+
+def load_package(name="sai_api"):
+    # The node pack lives in a directory that is not a valid module name, so load it by path
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, "__init__.py"), submodule_search_locations=[ROOT])
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def timed(fn, repeat):
+    # Best of repeat runs, and the size of what fn returned
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, len(out)
+
+
+def make_image(h, w):
+    # Smooth gradients plus noise, closer to a photo than pure noise
+    import torch
+    y = torch.linspace(0, 1, h)[:, None, None]
+    x = torch.linspace(0, 1, w)[None, :, None]
+    c = torch.tensor([0.2, 0.5, 0.8])[None, None, :]
+    image = (torch.sin(6 * x + 4 * y + 3 * c) * 0.4 + 0.5) + torch.randn(h, w, 3) * 0.02
+    return image.clamp(0, 1)[None]
@@ -0,0 +1,159 @@
+import argparse
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from mock_server import MockConfig, MockStabilityServer
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def peak_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return rss / 1024 ** 2 if sys.platform == "darwin" else rss / 1024
+
+
+class CollectingSink:
+    def __init__(self):
+        self.records = []
+        self.lock = threading.Lock()
+
+    def emit(self, record):
+        with self.lock:
+            self.records.append(record)
+
+
+def make_inputs(node, size):
+    import torch
+    spec = node.INPUT_TYPES()
+    kwargs = {}
+    for section in ("required", "optional"):
+        for name, (kind, *options) in spec.get(section, {}).items():
+            options = options[0] if options else {}
+            if name == "api_key_override":
+                kwargs[name] = "mock-key"
+            elif name == "tiled":
+                kwargs[name] = False
+            elif kind == "IMAGE":
+                kwargs[name] = torch.rand((1, size, size, 3))
+            elif kind == "MASK":
+                kwargs[name] = (torch.rand((1, size, size)) > 0.5).float()
+            elif kind == "STRING":
+                kwargs[name] = "a cat sitting on a windowsill"
+            elif isinstance(kind, list):
+                kwargs[name] = kind[0]
+            elif "default" in options:
+                kwargs[name] = options["default"]
+    return kwargs
+
+
+def run_node(label, node, args, sink):
+    inputs = make_inputs(node, args.image_size)
+    latencies = []
+    errors = 0
+    with sink.lock:
+        sink.records.clear()
+
+    def one(_):
+        start = time.perf_counter()
+        try:
+            node().call(**inputs)
+        except Exception:
+            return None
+        return time.perf_counter() - start
+
+    cpu_start = time.process_time()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        for latency in pool.map(one, range(args.requests)):
+            if latency is None:
+                errors += 1
+            else:
+                latencies.append(latency)
+    wall = time.perf_counter() - start
+    cpu = time.process_time() - cpu_start
+
+    phases = {}
+    for record in sink.records:
+        for name, seconds in record["phases"].items():
+            wall_total, cpu_total = phases.get(name, (0.0, 0.0))
+            phases[name] = (wall_total + seconds, cpu_total + record.get("cpu", {}).get(name, 0.0))
+
+    count = max(1, len(sink.records))
+    phase_text = " ".join(f"{name}={w / count * 1000:.0f}/{c / count * 1000:.0f}ms" for name, (w, c) in phases.items())
+    print(
+        f"{label:<52}{len(latencies) / wall:>8.2f}/s"
+        f"{percentile(latencies, 50) * 1000:>9.0f}{percentile(latencies, 95) * 1000:>9.0f}{percentile(latencies, 99) * 1000:>9.0f}"
+        f"{errors:>7}{cpu:>8.1f}s{peak_rss_mb():>9.0f}MB"
+    )
+    if args.phases:
+        print(f"    wall/cpu per call: {phase_text}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive every node against a local mock of the Stability API")
+    parser.add_argument("--nodes", default="", help="comma separated node names, default all")
+    parser.add_argument("--requests", type=int, default=32, help="calls per node")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--image-size", type=int, default=1024)
+    parser.add_argument("--latency", type=float, default=0.2, help="mock server latency in seconds")
+    parser.add_argument("--job-seconds", type=float, default=3.0, help="time until a polled job is ready")
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--rate-5xx", type=float, default=0.0)
+    parser.add_argument("--output-format", default="png", choices=["png", "webp", "jpeg"])
+    parser.add_argument("--phases", action="store_true", help="print the per-phase breakdown")
+    args = parser.parse_args()
+
+    config = MockConfig(args.latency, 0.05 * args.latency, args.job_seconds, args.rate_429, args.rate_5xx, output_format=args.output_format)
+    server = MockStabilityServer(config).start()
+
+    # The node pack reads its configuration at import time
+    os.environ["SAI_API_ROOT"] = server.url
+    os.environ.setdefault("SAI_API_METRICS", "none")
+    os.environ.setdefault("SAI_API_RATE_PER_SECOND", "1000")
+    os.environ.setdefault("SAI_API_RATE_BURST", "1000")
+    os.environ.setdefault("SAI_API_RETRY_BASE", "0.1")
+    # Every worker sends the same inputs; without these the run measures
+    # coalescing and cache hits, or resumes jobs from an earlier run
+    os.environ.setdefault("SAI_API_COALESCE", "0")
+    os.environ.setdefault("SAI_API_JOURNAL", "none")
+    os.environ.setdefault("SAI_API_PAYLOAD_CACHE_BYTES", "0")
+    # The (To File) nodes download every result
+    downloads = tempfile.mkdtemp(prefix="sai_api_loadtest_")
+    os.environ.setdefault("SAI_API_DOWNLOAD_DIR", downloads)
+    from common import load_package
+    package = load_package()
+    from sai_api import metrics, transport
+
+    sink = CollectingSink()
+    metrics.add_sink(sink)
+
+    selected = [n.strip() for n in args.nodes.split(",") if n.strip()]
+    print(f"{'node':<52}{'thrput':>10}{'p50ms':>9}{'p95ms':>9}{'p99ms':>9}{'errors':>7}{'cpu':>9}{'peakRSS':>11}")
+    for label, node in package.NODE_CLASS_MAPPINGS.items():
+        if selected and label not in selected:
+            continue
+        if "STABILITY_JOB" in node.RETURN_TYPES or not hasattr(node, "API_ENDPOINT"):
+            continue
+        run_node(label, node, args, sink)
+
+    print(f"server: {server.counts}")
+    print(f"transport: {transport.transport_stats()}")
+    server.stop()
+    shutil.rmtree(downloads, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
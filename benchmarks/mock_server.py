@@ -0,0 +1,217 @@
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+# Output size returned by each route, roughly what the real API sends back
+ENDPOINTS = {
+    "stable-image/generate/core": (1536, 1536),
+    "stable-image/generate/ultra": (1024, 1024),
+    "stable-image/generate/sd3": (1024, 1024),
+    "stable-image/upscale/conservative": (2048, 2048),
+    "stable-image/upscale/creative": (2048, 2048),
+    "stable-image/upscale/fast": (2048, 2048),
+    "stable-image/edit/remove-background": (1024, 1024),
+    "stable-image/edit/inpaint": (1024, 1024),
+    "stable-image/edit/erase": (1024, 1024),
+    "stable-image/edit/outpaint": (1024, 1024),
+    "stable-image/edit/search-and-replace": (1024, 1024),
+    "stable-image/edit/search-and-recolor": (1024, 1024),
+    "stable-image/edit/replace-background-and-relight": (1024, 1024),
+    "stable-image/control/sketch": (1024, 1024),
+    "stable-image/control/structure": (1024, 1024),
+    "stable-image/control/style": (1024, 1024),
+}
+POLLED = ("stable-image/upscale/creative", "stable-image/edit/replace-background-and-relight")
+PREFIX = "/v2beta/"
+
+
+class MockConfig:
+    def __init__(self, latency=0.2, jitter=0.05, job_seconds=3.0, rate_429=0.0, rate_5xx=0.0, retry_after=1, output_format="png"):
+        self.latency = latency
+        self.jitter = jitter
+        self.job_seconds = job_seconds
+        self.rate_429 = rate_429
+        self.rate_5xx = rate_5xx
+        self.retry_after = retry_after
+        self.output_format = output_format
+
+
+class MockState:
+    def __init__(self, config):
+        self.config = config
+        self.jobs = {}
+        self.images = {}
+        self.lock = threading.Lock()
+        self.counts = {"requests": 0, "throttled": 0, "errors": 0, "polls": 0}
+
+    def image(self, size):
+        # Smooth gradients plus noise so the encoded size is close to a real photo
+        with self.lock:
+            if size not in self.images:
+                w, h = size
+                y = np.linspace(0, 1, h)[:, None, None]
+                x = np.linspace(0, 1, w)[None, :, None]
+                c = np.array([0.2, 0.5, 0.8])[None, None, :]
+                pixels = (np.sin(6 * x + 4 * y + 3 * c) * 0.4 + 0.5) + np.random.randn(h, w, 3) * 0.02
+                buffered = BytesIO()
+                Image.fromarray((pixels.clip(0, 1) * 255).astype(np.uint8)).save(buffered, format=self.config.output_format.upper())
+                self.images[size] = buffered.getvalue()
+            return self.images[size]
+
+    def count(self, name):
+        with self.lock:
+            self.counts[name] += 1
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_body(self):
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            size = 0
+            while True:
+                length = int(self.rfile.readline().split(b";")[0], 16)
+                if length == 0:
+                    self.rfile.readline()
+                    return size
+                self.rfile.read(length)
+                self.rfile.readline()
+                size += length
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        return length
+
+    def _json(self, status, body, headers=None):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _image(self, endpoint):
+        state = self.server.state
+        payload = state.image(ENDPOINTS[endpoint])
+        self.send_response(200)
+        self.send_header("Content-Type", f"image/{state.config.output_format}")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _fault(self):
+        # Shared 429/5xx injection, returns True if an error was sent
+        state = self.server.state
+        config = state.config
+        roll = random.random()
+        if roll < config.rate_429:
+            state.count("throttled")
+            self._json(429, {"name": "rate_limit_exceeded", "errors": ["Too many requests"]}, {"Retry-After": str(config.retry_after)})
+            return True
+        if roll < config.rate_429 + config.rate_5xx:
+            state.count("errors")
+            self._json(503, {"name": "service_unavailable", "errors": ["Try again later"]})
+            return True
+        return False
+
+    def _delay(self):
+        config = self.server.state.config
+        time.sleep(max(0.0, random.gauss(config.latency, config.jitter)))
+
+    def do_POST(self):
+        state = self.server.state
+        state.count("requests")
+        self._read_body()
+        endpoint = self.path[len(PREFIX):] if self.path.startswith(PREFIX) else None
+        if endpoint not in ENDPOINTS:
+            return self._json(404, {"name": "not_found", "errors": [self.path]})
+        if not self.headers.get("Authorization"):
+            return self._json(401, {"name": "unauthorized", "errors": ["Missing API key"]})
+        self._delay()
+        if self._fault():
+            return
+        if endpoint in POLLED:
+            id = uuid.uuid4().hex
+            with state.lock:
+                state.jobs[id] = (endpoint, time.monotonic() + state.config.job_seconds)
+            return self._json(200, {"id": id})
+        self._image(endpoint)
+
+    def do_GET(self):
+        state = self.server.state
+        state.count("polls")
+        results = PREFIX + "results/"
+        if not self.path.startswith(results):
+            return self._json(404, {"name": "not_found", "errors": [self.path]})
+        if self._fault():
+            return
+        with state.lock:
+            job = state.jobs.get(self.path[len(results):])
+        if job is None:
+            return self._json(404, {"name": "not_found", "errors": ["Unknown generation id"]})
+        endpoint, ready_at = job
+        if time.monotonic() < ready_at:
+            return self._json(202, {"id": self.path[len(results):], "status": "in-progress"})
+        self._image(endpoint)
+
+
+class MockStabilityServer:
+    def __init__(self, config=None, host="127.0.0.1", port=0):
+        self.httpd = ThreadingHTTPServer((host, port), MockHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.state = MockState(config or MockConfig())
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}{PREFIX}"
+
+    @property
+    def counts(self):
+        return dict(self.httpd.state.counts)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the Stability v2beta API")
+    parser.add_argument("--port", type=int, default=8787)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--jitter", type=float, default=0.05)
+    parser.add_argument("--job-seconds", type=float, default=3.0)
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--rate-5xx", type=float, default=0.0)
+    parser.add_argument("--output-format", default="png", choices=["png", "webp", "jpeg"])
+    args = parser.parse_args()
+
+    config = MockConfig(args.latency, args.jitter, args.job_seconds, args.rate_429, args.rate_5xx, output_format=args.output_format)
+    server = MockStabilityServer(config, port=args.port)
+    print(f"Serving on {server.url}, use SAI_API_ROOT={server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
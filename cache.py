@@ -0,0 +1,145 @@
+import hashlib
+import os
+import struct
+import tempfile
+import threading
+import time
+
+from .multipart import part_digest
+
+CACHE_DIR = os.environ.get("SAI_API_CACHE_DIR")
+CACHE_MAX_BYTES = int(os.environ.get("SAI_API_CACHE_MAX_BYTES", 2 * 1024 ** 3))
+CACHE_TTL = float(os.environ.get("SAI_API_CACHE_TTL", 7 * 24 * 3600))
+
+# Every entry starts with its creation time so the TTL survives the mtime
+# updates used for LRU ordering
+_HEADER = struct.Struct(">d")
+_IGNORED_FIELDS = ("api_key_override",)
+
+
+def request_key(endpoint, accept, data, files):
+    # Canonical hash of a request payload: field order, the API key and lazy
+    # encoding don't change it
+    h = hashlib.sha256()
+    h.update(f"{endpoint}\0{accept}\0".encode())
+    for name in sorted(data or {}):
+        if name in _IGNORED_FIELDS or data[name] is None:
+            continue
+        h.update(f"{name}={data[name]}\0".encode())
+    for name in sorted(files or {}):
+        if files[name] is None:
+            continue
+        h.update(f"{name}:".encode())
+        h.update(part_digest(files[name], hashlib.sha256))
+    return h.hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, directory, max_bytes=CACHE_MAX_BYTES, ttl=CACHE_TTL):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0, "expired": 0}
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                created, = _HEADER.unpack(f.read(_HEADER.size))
+                if time.time() - created > self.ttl:
+                    content = None
+                else:
+                    content = f.read()
+        except (OSError, struct.error):
+            self._count("misses")
+            return None
+
+        if content is None:
+            self._remove(path)
+            self._count("expired")
+            self._count("misses")
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self._count("hits")
+        return content
+
+    def put(self, key, content):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temp file in the same directory and rename it into place so
+        # other workers sharing the directory never see a partial entry
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(_HEADER.pack(time.time()))
+                f.write(content)
+            os.replace(tmp, path)
+        except OSError:
+            self._remove(tmp)
+            return
+        self._count("writes")
+        self.evict()
+
+    def evict(self):
+        entries = []
+        total = 0
+        now = time.time()
+        for sub in os.scandir(self.directory):
+            if not sub.is_dir():
+                continue
+            for entry in os.scandir(sub.path):
+                if entry.name.startswith(".tmp-"):
+                    continue
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, entry.path))
+                total += st.st_size
+
+        entries.sort()
+        for mtime, size, path in entries:
+            # mtime is the last access, so anything untouched for a whole TTL is expired too
+            if total <= self.max_bytes and now - mtime <= self.ttl:
+                break
+            if self._remove(path):
+                total -= size
+                self._count("evictions")
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+            return True
+        except OSError:
+            return False
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    global _cache
+    if CACHE_DIR is None:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResponseCache(CACHE_DIR)
+    return _cache
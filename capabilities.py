@@ -0,0 +1,47 @@
+import os
+
+AUTO_DOWNSCALE = os.environ.get("SAI_API_AUTO_DOWNSCALE", "1").lower() in ("1", "true", "yes")
+
+
+class Capability:
+    # What an endpoint accepts for its image inputs. useful_pixels is the largest
+    # input that still changes the result, e.g. because the output is capped
+    def __init__(self, max_pixels=9_437_184, min_pixels=4_096, min_side=64, max_side=None,
+                 min_aspect=1 / 2.5, max_aspect=2.5, useful_pixels=None):
+        self.max_pixels = max_pixels
+        self.min_pixels = min_pixels
+        self.min_side = min_side
+        self.max_side = max_side
+        self.min_aspect = min_aspect
+        self.max_aspect = max_aspect
+        self.useful_pixels = useful_pixels
+
+    def validate(self, name, height, width):
+        aspect = width / height
+        if aspect < self.min_aspect - 1e-6 or aspect > self.max_aspect + 1e-6:
+            raise Exception(f"Stability API Error: Bad request.\n\n{name} aspect ratio {width}x{height} must be between 1:{1 / self.min_aspect:g} and {self.max_aspect:g}:1")
+        if min(height, width) < self.min_side or height * width < self.min_pixels:
+            raise Exception(f"Stability API Error: Bad request.\n\n{name} is {width}x{height}, every side must be at least {self.min_side} pixels and the total at least {self.min_pixels} pixels")
+
+    def fits(self, height, width):
+        return height * width <= self.max_pixels and (self.max_side is None or max(height, width) <= self.max_side)
+
+    def fit(self, height, width, useful=False):
+        # Largest size with the same aspect ratio that the endpoint accepts
+        max_pixels = self.max_pixels
+        if useful and self.useful_pixels is not None:
+            max_pixels = min(max_pixels, self.useful_pixels)
+        scale = 1.0
+        if height * width > max_pixels:
+            scale = (max_pixels / (height * width)) ** 0.5
+        if self.max_side is not None and max(height, width) * scale > self.max_side:
+            scale = self.max_side / max(height, width)
+        if min(height, width) * scale < self.min_side:
+            scale = self.min_side / min(height, width)
+        return max(1, int(height * scale)), max(1, int(width * scale))
+
+
+# Most edit and control routes
+DEFAULT = Capability()
+# Routes whose output is about one megapixel whatever the input size
+ONE_MEGAPIXEL_OUTPUT = Capability(useful_pixels=1_048_576)
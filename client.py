@@ -0,0 +1,453 @@
+# Request core shared by the ComfyUI nodes and the asyncio client. Like the rest
+# of the package it only imports the standard library up front.
+import functools
+import os
+import time
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+
+from .cache import get_cache, request_key
+from .coalesce import COALESCE, get_single_flight
+from .keys import EJECT_STATUSES, POOLED, get_key_pool, label
+from .metrics import CallMetrics
+from .multipart import MultipartStream
+
+ROOT_API = os.environ.get("SAI_API_ROOT", "https://api.stability.ai/v2beta/")
+API_KEY = os.environ.get("SAI_API_KEY")
+RESULTS_ENDPOINT = "results/"
+CLIENT_MAX_IN_FLIGHT = int(os.environ.get("SAI_API_CLIENT_MAX_IN_FLIGHT", 256))
+CLIENT_UPLOAD_THREADS = int(os.environ.get("SAI_API_CLIENT_UPLOAD_THREADS", 16))
+
+def get_api_key():
+    global API_KEY
+    if API_KEY is not None:
+        return API_KEY
+
+    # Check for API key in file as a backup, not recommended
+    try:
+        if not API_KEY:
+            dir_path = os.path.dirname(os.path.realpath(__file__))
+            with open(os.path.join(dir_path, "sai_platform_key.txt"), "r") as f:
+                API_KEY = f.read().strip()
+            # Validate the key is not empty
+            if API_KEY.strip() == "":
+                raise Exception(f"API Key is required to use the Stability API. \nPlease set the SAI_API_KEY environment variable to your API key or place in {dir_path}/sai_platform_key.txt.")
+
+    except Exception as e:
+        print(f"\n\n***API Key is required to use the Stability API. Please set the SAI_API_KEY environment variable to your API key or place in {dir_path}/sai_platform_key.txt.***\n\n")
+
+    return API_KEY
+
+
+def default_api_key():
+    # Requests take a key from the pool when SAI_API_KEYS is set, otherwise use the single key
+    return POOLED if get_key_pool() is not None else get_api_key()
+
+
+def raise_error(response):
+    error_info = response.json()
+    if error_info.get("name") == "unauthorized":
+        raise Exception("Stability API Error: Unauthorized.\n\nUse your Stability AI API key by:\n1. Setting the SAI_API_KEY environment variable to your API key\n2. Placing inside sai_platform_key.txt\n3. Passing the API key as an argument to the function with the key 'api_key_override'")
+    if error_info.get("name") == "payment_required":
+        raise Exception("Stability API Error: Not enough credits.\n\nPlease ensure your SAI API account has enough credits to complete this action.")
+    if error_info.get("name") == "bad_request":
+        errors = '\n'.join(error_info.get('errors'))
+        raise Exception(f"Stability API Error: Bad request.\n\n{errors}")
+    else:
+        raise Exception(f"Stability API Error: {error_info}")
+
+
+def shape_data(endpoint, data, files):
+    # Drops fields the route would reject or ignore, so the nodes and the
+    # asyncio client send the same payload for the same request
+    if endpoint == "stable-image/generate/sd3":
+        model = data.get("model", "sd3-large-turbo")
+        # SD3 models take no style preset, and Large Turbo no negative prompt
+        if "sd3-" in model:
+            data.pop("style_preset", None)
+        if model == "sd3-large-turbo":
+            data.pop("negative_prompt", None)
+    if files.get("subject_image") is not None:
+        # Relight images are file parts, never form fields
+        for name in ("subject_image", "background_reference", "light_reference"):
+            data.pop(name, None)
+        if files.get("light_reference") is not None:
+            data.pop("light_source_direction", None)
+        elif data.get("light_source_direction") == "none":
+            data.pop("light_source_strength", None)
+    return data
+
+
+def cache_lookup(endpoint, accept, data, files, metrics):
+    # Returns (cache_key, content). The key also identifies identical requests
+    # in flight, so it is computed whenever coalescing is on
+    cache = get_cache()
+    if cache is None and not COALESCE:
+        return None, None
+    with metrics.phase("cache"):
+        cache_key = request_key(endpoint, accept, data, files)
+        content = cache.get(cache_key) if cache is not None else None
+    if content is not None:
+        metrics.status = "cache_hit"
+    return cache_key, content
+
+
+def cache_put(cache_key, content):
+    cache = get_cache()
+    if cache is not None and cache_key is not None:
+        cache.put(cache_key, content)
+
+
+def coalesced(cache_key, headers, fn, metrics):
+    # Runs fn once for every identical request in flight with the same API key
+    if cache_key is None or not COALESCE:
+        return fn()
+    return get_single_flight().do((headers["Authorization"], cache_key), fn, metrics)
+
+
+def submit(endpoint, headers, data, files, metrics, stream=False):
+    # POST one multipart request through the shared scheduler and session. A
+    # pooled request takes a key per attempt and moves on to another key when
+    # one is throttled or refused; headers is updated with the key that was
+    # used, so the generation is polled with it
+    from requests.models import PreparedRequest
+    from .scheduler import MAX_RETRIES, get_scheduler, retry_after
+    from .transport import get_session
+
+    req = PreparedRequest()
+    req.prepare_method('POST')
+    req.prepare_url(f"{ROOT_API}{endpoint}", None)
+    req.prepare_headers(headers)
+    with metrics.phase("body"):
+        body = MultipartStream(data, files)
+        req.prepare_body(data=body, files=None)
+        req.headers["Content-Type"] = body.content_type
+
+    def send():
+        sent_at = time.monotonic()
+        response = get_session().send(req, stream=stream)
+        headers_at = sent_at + response.elapsed.total_seconds()
+        uploaded_at = body.finished or headers_at
+        metrics.payload_bytes = body.bytes_sent
+        metrics.add("upload", uploaded_at - sent_at)
+        metrics.add("server", headers_at - uploaded_at)
+        metrics.add("download", time.monotonic() - headers_at)
+        return response
+
+    pool = get_key_pool() if headers["Authorization"] == POOLED else None
+    if pool is None:
+        response = get_scheduler().request(headers["Authorization"], send, metrics=metrics)
+    else:
+        last = None
+        for attempt in range(len(pool.keys) + MAX_RETRIES + 1):
+            try:
+                api_key = pool.acquire()
+            except Exception:
+                if last is not None:
+                    raise_error(last)
+                raise
+            req.headers["Authorization"] = api_key
+            try:
+                response = get_scheduler().request(api_key, send, metrics=metrics, retry_throttled=False)
+            except Exception:
+                pool.release(api_key, None)
+                raise
+            pool.release(api_key, response.status_code, retry_after(response))
+            if last is not None:
+                last.close()
+            last = response
+            if response.status_code not in EJECT_STATUSES:
+                break
+            metrics.retries += 1
+        headers["Authorization"] = api_key
+        metrics.api_key = label(api_key)
+    metrics.add("encode", body.encode_seconds)
+
+    if response.status_code != 200:
+        raise_error(response)
+    return response
+
+
+def poll(id, headers):
+    # Future resolving to a PollResult once the generation is ready; the body
+    # of its response is read by the caller, with read()
+    from .polling import get_poller
+    return get_poller().submit(f"{ROOT_API}{RESULTS_ENDPOINT}{id}", headers)
+
+
+def start_job(endpoint, headers, data, files, metrics, cache_key=None):
+    # Generation id for a polled request. When the journal has a pending
+    # generation for this exact payload, e.g. from before a restart, it is
+    # resumed instead of submitting and paying again
+    from .journal import get_journal
+    journal = get_journal()
+    if journal is not None:
+        cache_key = cache_key or request_key(endpoint, headers["Accept"], data, files)
+        api_keys = get_key_pool().keys if headers["Authorization"] == POOLED else [headers["Authorization"]]
+        id, api_key = journal.resume(cache_key, api_keys)
+        if id is not None:
+            headers["Authorization"] = api_key
+            metrics.status = "resumed"
+            return id
+    id = submit(endpoint, headers, data, files, metrics).json().get("id")
+    if journal is not None:
+        journal.record(cache_key, headers["Authorization"], endpoint, id)
+    return id
+
+
+def end_job(id, error=None):
+    from .journal import get_journal
+    from .polling import GenerationFailed
+    journal = get_journal()
+    if journal is None:
+        return
+    if error is None:
+        journal.complete(id)
+    elif isinstance(error, GenerationFailed):
+        journal.fail(id)
+    else:
+        journal.release(id)
+
+
+def release_job(id):
+    # The generation is ready but the caller didn't keep it; leave it in the
+    # journal to be resumed
+    from .journal import get_journal
+    journal = get_journal()
+    if journal is not None:
+        journal.release(id)
+
+
+def abandon_job(id, future):
+    # The caller stopped waiting on a polled generation. Once polling ends it
+    # is left in the journal to be resumed, and its response is let go
+    def done(future):
+        try:
+            result = future.result()
+        except BaseException as e:
+            end_job(id, e)
+            return
+        result.response.close()
+        release_job(id)
+
+    future.add_done_callback(done)
+
+
+def wait_job(id, headers, metrics):
+    with metrics.phase("poll"):
+        try:
+            result = poll(id, headers).result()
+        except BaseException as e:
+            end_job(id, e)
+            raise
+    end_job(id)
+    metrics.polls = result.polls
+    return result.response
+
+
+def read(response, metrics, to_file=False):
+    if to_file:
+        from .download import stream_to_file
+        with metrics.phase("download"):
+            return stream_to_file(response)
+    return response.content
+
+
+def send(endpoint, headers, data, files, metrics, polled=False, to_file=False, cache_key=None):
+    # Submit, wait for a polled generation if needed, and return the content,
+    # or the path of the downloaded file with to_file
+    if polled:
+        id = start_job(endpoint, headers, data, files, metrics, cache_key)
+        response = wait_job(id, headers, metrics)
+    else:
+        response = submit(endpoint, headers, data, files, metrics, stream=to_file)
+    return read(response, metrics, to_file)
+
+
+def _close_result(future):
+    if not future.cancelled() and future.exception() is None:
+        response = getattr(future.result(), "response", None)
+        if response is not None:
+            response.close()
+
+
+async def _wait(future):
+    # Awaits a future that other callers or the poller thread share. It is
+    # shielded, because cancelling an asyncio wrapper would cancel the shared
+    # future with it; a poll result nobody waits for any more is closed
+    import asyncio
+    try:
+        return await asyncio.shield(asyncio.wrap_future(future))
+    except asyncio.CancelledError:
+        future.add_done_callback(_close_result)
+        raise
+
+
+EDIT_OPERATIONS = ("inpaint", "erase", "outpaint", "search-and-replace", "search-and-recolor", "remove-background")
+CONTROL_KINDS = ("sketch", "structure", "style")
+UPSCALE_MODES = ("conservative", "creative", "fast")
+
+
+class AsyncStabilityClient:
+    # asyncio front end for scripts that keep many generations in flight. Uploads
+    # run on a small thread pool; waiting on polled generations holds no thread,
+    # so max_in_flight can be far larger than upload_threads.
+    #
+    #     async with AsyncStabilityClient() as client:
+    #         png = await client.generate_core("a lighthouse at dusk", seed=7)
+    #
+    # Images can be encoded bytes, HWC arrays or tensors (uint8, or float in 0..1).
+    # Results are the encoded bytes, or a file path with to_file=True.
+    def __init__(self, api_key=None, max_in_flight=CLIENT_MAX_IN_FLIGHT, upload_threads=CLIENT_UPLOAD_THREADS):
+        self.api_key = api_key
+        self.max_in_flight = max_in_flight
+        self._executor = ThreadPoolExecutor(max_workers=upload_threads, thread_name_prefix="sai-client")
+        self._semaphore = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+    async def generate_core(self, prompt, **fields):
+        return await self.request("stable-image/generate/core", dict(fields, prompt=prompt))
+
+    async def generate_ultra(self, prompt, image=None, **fields):
+        return await self.request("stable-image/generate/ultra", self._mode(fields, prompt, image), {"image": image})
+
+    async def generate_sd3(self, prompt, model="sd3.5-large", image=None, **fields):
+        return await self.request("stable-image/generate/sd3", self._mode(dict(fields, model=model), prompt, image), {"image": image})
+
+    async def edit(self, operation, image, mask=None, **fields):
+        if operation not in EDIT_OPERATIONS:
+            raise Exception(f"Stability API Error: Unknown edit operation '{operation}', expected one of {EDIT_OPERATIONS}")
+        return await self.request(f"stable-image/edit/{operation}", fields, {"image": image, "mask": mask}, seeded=operation != "remove-background")
+
+    async def control(self, kind, image, prompt, **fields):
+        if kind not in CONTROL_KINDS:
+            raise Exception(f"Stability API Error: Unknown control kind '{kind}', expected one of {CONTROL_KINDS}")
+        return await self.request(f"stable-image/control/{kind}", dict(fields, prompt=prompt), {"image": image})
+
+    async def upscale(self, mode, image, prompt=None, **fields):
+        if mode not in UPSCALE_MODES:
+            raise Exception(f"Stability API Error: Unknown upscale mode '{mode}', expected one of {UPSCALE_MODES}")
+        if prompt is not None:
+            fields = dict(fields, prompt=prompt)
+        return await self.request(f"stable-image/upscale/{mode}", fields, {"image": image},
+                                  accept="*/*" if mode == "creative" else "image/*", polled=mode == "creative", seeded=mode != "fast")
+
+    async def relight(self, subject_image, background_reference=None, light_reference=None, **fields):
+        files = {"subject_image": subject_image, "background_reference": background_reference, "light_reference": light_reference}
+        return await self.request("stable-image/edit/replace-background-and-relight", fields, files, accept="*/*", polled=True)
+
+    async def request(self, endpoint, data=None, files=None, accept="image/*", polled=False, seeded=True, to_file=False):
+        # seeded routes pick a random seed when none (or 0) is given, so only a
+        # fixed seed makes the result cacheable
+        data = {k: v for k, v in (data or {}).items() if v is not None}
+        files = {k: v for k, v in (files or {}).items() if v is not None} or {"none": None}
+        data = shape_data(endpoint, data, files)
+        headers = {"Authorization": self.api_key or default_api_key(), "Accept": accept}
+        if headers["Authorization"] is None:
+            raise Exception("No Stability key set.\n\nPass api_key to the client or set the SAI_API_KEY environment variable")
+        deterministic = not to_file and (not seeded or int(data.get("seed", 0) or 0) != 0)
+
+        import asyncio
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        loop = asyncio.get_running_loop()
+        metrics = CallMetrics(endpoint)
+        async with self._semaphore:
+            try:
+                files, cache_key, content = await loop.run_in_executor(
+                    self._executor, functools.partial(self._prepare, endpoint, headers, data, files, metrics, deterministic))
+                if content is None:
+                    content = await self._fetch(endpoint, headers, data, files, metrics, cache_key, polled, to_file)
+            except Exception:
+                metrics.finish("error")
+                raise
+        metrics.response_bytes = os.path.getsize(content) if to_file else len(content)
+        metrics.finish()
+        return content
+
+    def _prepare(self, endpoint, headers, data, files, metrics, deterministic):
+        # Blocking part before the upload: encode and cache lookup
+        with metrics.phase("encode"):
+            files = {name: self._encode(name, value) for name, value in files.items()}
+        if not deterministic:
+            return files, None, None
+        cache_key, content = cache_lookup(endpoint, headers["Accept"], data, files, metrics)
+        return files, cache_key, content
+
+    async def _fetch(self, endpoint, headers, data, files, metrics, cache_key, polled, to_file):
+        import asyncio
+        if cache_key is None or not COALESCE:
+            return await self._exchange(endpoint, headers, data, files, metrics, cache_key, polled, to_file)
+
+        # Shares in-flight requests with the nodes and other clients in this process
+        key = (headers["Authorization"], cache_key)
+        flight = get_single_flight()
+        future, leader = flight.join(key)
+        if not leader:
+            metrics.status = "coalesced"
+            with metrics.phase("coalesced"):
+                return await _wait(future)
+
+        # The request runs in its own task, so cancelling this caller doesn't
+        # take the result away from the callers waiting on it
+        def done(task):
+            if task.cancelled():
+                flight.finish(key, future, error=CancelledError())
+            elif task.exception() is not None:
+                flight.finish(key, future, error=task.exception())
+            else:
+                flight.finish(key, future, task.result())
+
+        work = asyncio.ensure_future(self._exchange(endpoint, headers, data, files, metrics, cache_key, polled, to_file))
+        work.add_done_callback(done)
+        return await asyncio.shield(work)
+
+    async def _exchange(self, endpoint, headers, data, files, metrics, cache_key, polled, to_file):
+        import asyncio
+        loop = asyncio.get_running_loop()
+        if polled:
+            id = await loop.run_in_executor(self._executor, start_job, endpoint, headers, data, files, metrics, cache_key)
+            with metrics.phase("poll"):
+                try:
+                    result = await _wait(poll(id, headers))
+                except BaseException as e:
+                    end_job(id, e)
+                    raise
+            end_job(id)
+            metrics.polls = result.polls
+            response = result.response
+        else:
+            response = await loop.run_in_executor(self._executor, functools.partial(submit, endpoint, headers, data, files, metrics, to_file))
+        # Reading the body blocks, keep it off the event loop
+        content = await loop.run_in_executor(self._executor, read, response, metrics, to_file)
+        if not to_file:
+            cache_put(cache_key, content)
+        return content
+
+    @staticmethod
+    def _mode(fields, prompt, image):
+        fields = dict(fields, prompt=prompt)
+        if image is not None:
+            fields["mode"] = "image-to-image"
+            fields.pop("aspect_ratio", None)
+        else:
+            fields.pop("strength", None)
+        return fields
+
+    @staticmethod
+    def _encode(name, value):
+        if value is None or isinstance(value, (bytes, bytearray, memoryview)):
+            return value
+        import torch
+        from .encoder import encode_image, encode_mask
+        tensor = torch.as_tensor(value)
+        if name == "mask":
+            return encode_mask(tensor if tensor.dtype != torch.uint8 else tensor.float() / 255)
+        return encode_image(tensor)
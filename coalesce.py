@@ -0,0 +1,66 @@
+import os
+import threading
+from concurrent.futures import Future, InvalidStateError
+
+COALESCE = os.environ.get("SAI_API_COALESCE", "1").lower() in ("1", "true", "yes")
+
+
+class SingleFlight:
+    # Identical requests that are in flight at the same time share one HTTP
+    # request. The first caller for a key is the leader and sends it; later
+    # callers wait on the leader's future and receive the same result or error.
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._stats = {"leaders": 0, "coalesced": 0}
+
+    def join(self, key):
+        # Returns (future, leader)
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                self._stats["coalesced"] += 1
+                return future, False
+            future = self._calls[key] = Future()
+            self._stats["leaders"] += 1
+            return future, True
+
+    def finish(self, key, future, result=None, error=None):
+        with self._lock:
+            if self._calls.get(key) is future:
+                del self._calls[key]
+        # A waiter may have cancelled the future; the leader's result must not fail because of it
+        try:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+        except InvalidStateError:
+            pass
+
+    def do(self, key, fn, metrics=None):
+        future, leader = self.join(key)
+        if not leader:
+            if metrics is not None:
+                metrics.status = "coalesced"
+                with metrics.phase("coalesced"):
+                    return future.result()
+            return future.result()
+        try:
+            result = fn()
+        except BaseException as e:
+            self.finish(key, future, error=e)
+            raise
+        self.finish(key, future, result)
+        return result
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, in_flight=len(self._calls))
+
+
+_single_flight = SingleFlight()
+
+
+def get_single_flight():
+    return _single_flight
@@ -0,0 +1,35 @@
+import os
+from io import BytesIO
+
+import torch
+from PIL import Image
+
+OUTPUT_DTYPE = os.environ.get("SAI_API_OUTPUT_DTYPE", "float32")
+
+_DTYPES = {"float32": torch.float32, "float16": torch.float16, "uint8": torch.uint8}
+
+
+def open_image(content):
+    # content is the encoded bytes or a path to a downloaded file
+    image = Image.open(BytesIO(content) if isinstance(content, (bytes, bytearray)) else content)
+    # Only keep an alpha channel when the response actually has one
+    mode = "RGBA" if "A" in image.getbands() or "transparency" in image.info else "RGB"
+    if image.mode != mode:
+        image = image.convert(mode)
+    return image
+
+
+def decode_image(content, dtype=OUTPUT_DTYPE):
+    image = open_image(content)
+    image.load()
+    channels = len(image.getbands())
+    out = torch.empty((1, image.height, image.width, channels), dtype=_DTYPES[dtype])
+    # Fill the output tensor in place through its numpy view, casting from the
+    # decoded uint8 pixels without any intermediate float arrays. numpy reads
+    # the pixels through PIL's array interface, which copies them to bytes
+    # first, so even uint8 output is a copy of the decoded image, not a view
+    out.numpy()[0][...] = image
+    image.close()
+    if out.dtype != torch.uint8:
+        out.mul_(1.0 / 255.0)
+    return out
@@ -0,0 +1,67 @@
+import mimetypes
+import os
+import tempfile
+import uuid
+
+DOWNLOAD_CHUNK_SIZE = int(os.environ.get("SAI_API_DOWNLOAD_CHUNK_SIZE", 1024 * 1024))
+DOWNLOAD_DIR = os.environ.get("SAI_API_DOWNLOAD_DIR")
+
+_EXTENSIONS = {"image/png": ".png", "image/jpeg": ".jpeg", "image/webp": ".webp", "video/mp4": ".mp4"}
+
+
+def output_directory():
+    if DOWNLOAD_DIR:
+        directory = DOWNLOAD_DIR
+    else:
+        try:
+            import folder_paths
+            directory = os.path.join(folder_paths.get_output_directory(), "stability")
+        except ImportError:
+            directory = os.path.join(tempfile.gettempdir(), "sai_api")
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def _sniff(content):
+    if content.startswith(b"\x89PNG"):
+        return "image/png"
+    if content.startswith(b"\xff\xd8"):
+        return "image/jpeg"
+    if content[:4] == b"RIFF" and content[8:12] == b"WEBP":
+        return "image/webp"
+    if content[4:8] == b"ftyp":
+        return "video/mp4"
+    return ""
+
+
+def write_chunks(chunks, content_type, directory=None, prefix="stability"):
+    # Written under a temporary name and renamed, so a path handed downstream
+    # always points at a complete file
+    directory = directory or output_directory()
+    suffix = _EXTENSIONS.get(content_type) or mimetypes.guess_extension(content_type) or ".bin"
+    path = os.path.join(directory, f"{prefix}_{uuid.uuid4().hex[:12]}{suffix}")
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return path
+
+
+def stream_to_file(response, directory=None, prefix="stability"):
+    # Writes a streamed (stream=True) response to disk one chunk at a time and
+    # returns the path; the body is never held in memory as a whole
+    content_type = response.headers.get("Content-Type", "").split(";")[0].strip()
+    try:
+        return write_chunks(response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE), content_type, directory, prefix)
+    finally:
+        response.close()
+
+
+def save_content(content, directory=None, prefix="stability"):
+    return write_chunks([content], _sniff(content), directory, prefix)
@@ -0,0 +1,101 @@
+import hashlib
+import os
+from io import BytesIO
+
+import numpy as np
+import torch
+from PIL import Image
+
+UPLOAD_FORMAT = os.environ.get("SAI_API_UPLOAD_FORMAT", "png")
+UPLOAD_COMPRESS_LEVEL = int(os.environ.get("SAI_API_UPLOAD_COMPRESS_LEVEL", 1))
+UPLOAD_QUALITY = int(os.environ.get("SAI_API_UPLOAD_QUALITY", 95))
+MASK_BITS = int(os.environ.get("SAI_API_MASK_BITS", 8))
+
+_MODES = {1: "L", 2: "LA", 3: "RGB", 4: "RGBA"}
+
+
+def to_uint8(tensor):
+    # [H,W,C] or [1,H,W,C] float in 0..1 -> contiguous HWC uint8, quantized where the tensor lives
+    if isinstance(tensor, np.ndarray):
+        return np.ascontiguousarray(tensor)
+    t = tensor.detach()
+    if t.dim() == 4:
+        t = t[0]
+    if t.dtype != torch.uint8:
+        t = t.mul(255).add_(0.5).clamp_(0, 255).to(torch.uint8)
+    return np.ascontiguousarray(t.cpu().numpy())
+
+
+def to_pil(tensor):
+    array = to_uint8(tensor)
+    if array.ndim == 2:
+        return Image.fromarray(array, "L")
+    if array.shape[-1] == 1:
+        return Image.fromarray(array[..., 0], "L")
+    return Image.fromarray(array, _MODES[array.shape[-1]])
+
+
+def save_image(image, fp, format=None, compress_level=None, quality=None):
+    format = (format or UPLOAD_FORMAT).lower()
+    compress_level = UPLOAD_COMPRESS_LEVEL if compress_level is None else compress_level
+    quality = UPLOAD_QUALITY if quality is None else quality
+    if format == "png":
+        image.save(fp, format="PNG", compress_level=compress_level)
+    elif format == "webp":
+        image.save(fp, format="WEBP", lossless=True, quality=100, method=min(compress_level, 6))
+    elif format in ("jpeg", "jpg"):
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        image.save(fp, format="JPEG", quality=quality, subsampling=0)
+    else:
+        raise Exception(f"Stability API Error: Unsupported upload format '{format}'")
+
+
+def encode_image(tensor, format=None, compress_level=None, quality=None, fp=None):
+    buffered = BytesIO() if fp is None else fp
+    save_image(to_pil(tensor), buffered, format, compress_level, quality)
+    return buffered.getvalue() if fp is None else fp
+
+
+def encode_mask(mask, bits=None, compress_level=None):
+    # MASK is [H,W] or [1,H,W] in 0..1; sent as a single channel PNG, 8-bit
+    # grayscale or 1-bit thresholded at 0.5
+    bits = MASK_BITS if bits is None else bits
+    m = mask.detach().reshape(-1, mask.shape[-2], mask.shape[-1])[0]
+    if bits == 1:
+        image = Image.fromarray(np.ascontiguousarray(m.ge(0.5).cpu().numpy()))
+    else:
+        image = Image.fromarray(to_uint8(m[..., None])[..., 0], "L")
+    buffered = BytesIO()
+    image.save(buffered, format="PNG", compress_level=UPLOAD_COMPRESS_LEVEL if compress_level is None else compress_level)
+    return buffered.getvalue()
+
+
+def tensor_fingerprint(tensor, *extra):
+    # Identifies the encoded upload without encoding it: the quantized pixels,
+    # a quarter of the bytes of a float tensor, plus anything that changes the
+    # encoder output
+    array = to_uint8(tensor)
+    h = hashlib.sha256(f"{array.shape}{extra}".encode())
+    h.update(memoryview(array).cast("B"))
+    return h.digest()
+
+
+class QuantizedImage:
+    # An image input quantized once, on first use, and shared by its
+    # fingerprint and the encoder
+    def __init__(self, tensor, *extra):
+        self.tensor = tensor
+        self.extra = extra
+        self._pixels = None
+        self._fingerprint = None
+
+    def pixels(self):
+        if self._pixels is None:
+            self._pixels = to_uint8(self.tensor)
+        return self._pixels
+
+    def fingerprint(self):
+        if self._fingerprint is None:
+            self._fingerprint = tensor_fingerprint(self.pixels(), *self.extra)
+        return self._fingerprint
@@ -0,0 +1,205 @@
+import hashlib
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+JOURNAL_PATH = os.environ.get("SAI_API_JOURNAL")
+# Generations can be fetched for 24 hours after they are submitted
+JOURNAL_PENDING_TTL = float(os.environ.get("SAI_API_JOURNAL_PENDING_TTL", 23 * 3600))
+JOURNAL_RETENTION = float(os.environ.get("SAI_API_JOURNAL_RETENTION", 24 * 3600))
+# How long a process may hold a generation before others can take it over
+JOURNAL_CLAIM_SECONDS = float(os.environ.get("SAI_API_JOURNAL_CLAIM_SECONDS", 3600))
+
+# Identifies this process in claims: host, pid and a token that survives pid reuse
+_HOST = socket.gethostname()
+OWNER = f"{_HOST}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+logger = logging.getLogger("sai_api")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    generation_id TEXT PRIMARY KEY,
+    payload TEXT NOT NULL,
+    account TEXT NOT NULL,
+    endpoint TEXT NOT NULL,
+    submitted REAL NOT NULL,
+    completed REAL,
+    claimed_by TEXT,
+    claimed_until REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_payload ON jobs (payload, account);
+"""
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass
+    return True
+
+
+def _account(api_key):
+    # Jobs can only be fetched with the key that submitted them; store a digest, not the key
+    return hashlib.sha256((api_key or "").encode()).hexdigest()[:16]
+
+
+class JobJournal:
+    # Records polled generations when they are submitted, so re-running the
+    # same request after a restart resumes polling the paid-for generation
+    # instead of submitting it again. Safe to share between processes: a
+    # generation is claimed in the database by the process waiting on it, and
+    # the claim lapses when that process exits or after claim_seconds.
+    def __init__(self, path, pending_ttl=JOURNAL_PENDING_TTL, retention=JOURNAL_RETENTION, claim_seconds=JOURNAL_CLAIM_SECONDS, owner=OWNER):
+        self.path = path
+        self.pending_ttl = pending_ttl
+        self.retention = retention
+        self.claim_seconds = claim_seconds
+        self.owner = owner
+        self._active = set()
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._stats = {"recorded": 0, "resumed": 0, "completed": 0, "failed": 0, "collected": 0}
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(jobs)")}
+        for column, kind in (("claimed_by", "TEXT"), ("claimed_until", "REAL")):
+            if column not in columns:
+                # Journals written before claims were stored in the database
+                self._db.execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind}")
+        self.collect()
+
+    def resume(self, payload, api_keys):
+        # A pending generation for this payload, submitted with one of api_keys,
+        # that no process is already waiting on. It is claimed for the caller;
+        # returns (generation_id, api_key) or (None, None)
+        accounts = {_account(k): k for k in api_keys}
+        now = time.time()
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT generation_id, account, claimed_by, claimed_until FROM jobs WHERE payload = ? AND account IN ({','.join('?' * len(accounts))}) AND completed IS NULL AND submitted > ? ORDER BY submitted",
+                (payload, *accounts, now - self.pending_ttl),
+            ).fetchall()
+            for generation_id, account, claimed_by, claimed_until in rows:
+                if claimed_by is not None and not self._stale(claimed_by, claimed_until, now):
+                    continue
+                # Only one process wins the claim, even if several read the row
+                cursor = self._db.execute(
+                    "UPDATE jobs SET claimed_by = ?, claimed_until = ? WHERE generation_id = ? AND completed IS NULL AND claimed_by IS ? AND claimed_until IS ?",
+                    (self.owner, now + self.claim_seconds, generation_id, claimed_by, claimed_until),
+                )
+                if cursor.rowcount == 1:
+                    self._active.add(generation_id)
+                    self._stats["resumed"] += 1
+                    return generation_id, accounts[account]
+        return None, None
+
+    def _stale(self, owner, until, now):
+        if owner == self.owner:
+            return False
+        if until is None or until < now:
+            return True
+        host, _, rest = owner.partition(":")
+        pid = rest.partition(":")[0]
+        if host != _HOST or os.name != "posix" or not pid.isdigit():
+            return False
+        # Same host: a claim by an earlier process with this pid, or by one
+        # that has exited, is left over from a restart
+        return int(pid) == os.getpid() or not _alive(int(pid))
+
+    def record(self, payload, api_key, endpoint, generation_id):
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO jobs (generation_id, payload, account, endpoint, submitted, claimed_by, claimed_until) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (generation_id, payload, _account(api_key), endpoint, now, self.owner, now + self.claim_seconds),
+            )
+            self._active.add(generation_id)
+            self._stats["recorded"] += 1
+            self._writes += 1
+            collect = self._writes % 100 == 0
+        if collect:
+            self.collect()
+
+    def complete(self, generation_id):
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET completed = ?, claimed_by = NULL, claimed_until = NULL WHERE generation_id = ?",
+                (time.time(), generation_id),
+            )
+            self._active.discard(generation_id)
+            self._stats["completed"] += 1
+
+    def fail(self, generation_id):
+        # The generation can't be fetched any more, the next run submits again
+        with self._lock:
+            self._db.execute("DELETE FROM jobs WHERE generation_id = ?", (generation_id,))
+            self._active.discard(generation_id)
+            self._stats["failed"] += 1
+
+    def release(self, generation_id):
+        # Still pending on the server (e.g. polling timed out), leave it to be resumed
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET claimed_by = NULL, claimed_until = NULL WHERE generation_id = ? AND claimed_by = ?",
+                (generation_id, self.owner),
+            )
+            self._active.discard(generation_id)
+
+    def collect(self):
+        now = time.time()
+        with self._lock:
+            cursor = self._db.execute(
+                "DELETE FROM jobs WHERE (completed IS NOT NULL AND completed < ?) OR (completed IS NULL AND submitted < ?)",
+                (now - self.retention, now - self.pending_ttl),
+            )
+            self._stats["collected"] += max(0, cursor.rowcount)
+
+    def stats(self):
+        with self._lock:
+            pending, = self._db.execute("SELECT COUNT(*) FROM jobs WHERE completed IS NULL").fetchone()
+            return dict(self._stats, pending=pending, active=len(self._active))
+
+
+def journal_path():
+    if JOURNAL_PATH:
+        return JOURNAL_PATH
+    # The package directory may be read-only or shared between installs
+    try:
+        import folder_paths
+        directory = os.path.join(folder_paths.get_user_directory(), "sai_api")
+    except (ImportError, AttributeError):
+        directory = os.path.join(os.path.expanduser("~"), ".cache", "sai_api")
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, "sai_jobs.sqlite3")
+
+
+_journal = None
+_journal_loaded = False
+_journal_lock = threading.Lock()
+
+
+def get_journal():
+    # None if the journal is disabled or can't be opened; requests then
+    # run without it rather than failing
+    global _journal, _journal_loaded
+    if JOURNAL_PATH and JOURNAL_PATH.lower() == "none":
+        return None
+    if not _journal_loaded:
+        with _journal_lock:
+            if not _journal_loaded:
+                path = None
+                try:
+                    path = journal_path()
+                    _journal = JobJournal(path)
+                except (sqlite3.Error, OSError) as e:
+                    logger.warning("Stability API job journal disabled, could not open %s: %s", path, e)
+                _journal_loaded = True
+    return _journal
@@ -0,0 +1,164 @@
+import os
+import threading
+import time
+
+API_KEYS = os.environ.get("SAI_API_KEYS", "")
+API_KEYS_FILE = os.environ.get("SAI_API_KEYS_FILE", "")
+KEY_STRATEGY = os.environ.get("SAI_API_KEY_STRATEGY", "least_outstanding")
+KEY_EJECT_SECONDS = float(os.environ.get("SAI_API_KEY_EJECT_SECONDS", 300))
+KEY_THROTTLE_SECONDS = float(os.environ.get("SAI_API_KEY_THROTTLE_SECONDS", 10))
+KEY_EJECT_MAX = float(os.environ.get("SAI_API_KEY_EJECT_MAX", 3600))
+KEY_MAX_WAIT = float(os.environ.get("SAI_API_KEY_MAX_WAIT", 30))
+
+# Stand-in Authorization value for requests that take their key from the pool.
+# It is swapped for a real key when the request is sent.
+POOLED = "sai-api-key-pool"
+# Responses that say the key, not the request, is the problem
+EJECT_STATUSES = (401, 402, 429)
+
+
+def parse_keys(text):
+    # One key per line or comma, optionally followed by ":weight"
+    keys = []
+    for item in text.replace(",", "\n").splitlines():
+        item = item.strip()
+        if not item or item.startswith("#"):
+            continue
+        key, _, weight = item.partition(":")
+        keys.append((key.strip(), float(weight) if weight.strip() else 1.0))
+    return keys
+
+
+def label(api_key):
+    # Safe to log: enough of the key to tell them apart
+    return f"...{api_key[-4:]}" if api_key and len(api_key) > 8 else "key"
+
+
+class _Key:
+    def __init__(self, api_key, weight):
+        self.api_key = api_key
+        self.label = label(api_key)
+        self.weight = weight
+        self.current = 0.0
+        self.outstanding = 0
+        self.ejected_until = 0.0
+        self.eject_seconds = 0.0
+        self.probing = False
+        self.stats = {"requests": 0, "ok": 0, "ejections": 0, "401": 0, "402": 0, "429": 0}
+
+    def available(self, now):
+        return now >= self.ejected_until and not self.probing
+
+
+class KeyPool:
+    # Spreads requests over several API keys, each with its own rate limit.
+    # A key that is throttled, unauthorized or out of credits is ejected for a
+    # while; after that a single probe request decides whether it comes back.
+    def __init__(self, keys, strategy=KEY_STRATEGY):
+        if strategy not in ("least_outstanding", "weighted"):
+            raise Exception(f"Stability API Error: Unknown SAI_API_KEY_STRATEGY '{strategy}', expected 'least_outstanding' or 'weighted'")
+        self.strategy = strategy
+        self._keys = [_Key(k, w) for k, w in keys]
+        self._by_key = {k.api_key: k for k in self._keys}
+        self._cond = threading.Condition()
+
+    @property
+    def keys(self):
+        return [k.api_key for k in self._keys]
+
+    def acquire(self, max_wait=KEY_MAX_WAIT):
+        deadline = time.monotonic() + max_wait
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                key = self._pick(now)
+                if key is not None:
+                    if now >= key.ejected_until and key.ejected_until > 0:
+                        # First request after an ejection is the probe
+                        key.probing = True
+                    key.outstanding += 1
+                    key.stats["requests"] += 1
+                    return key.api_key
+                wake = min((k.ejected_until for k in self._keys if not k.probing), default=now + 1.0)
+                if wake > deadline:
+                    reasons = ", ".join(f"{k.label} for {max(0, int(k.ejected_until - now))}s" for k in self._keys)
+                    raise Exception(f"Stability API Error: Every pooled API key is unavailable ({reasons}).")
+                self._cond.wait(max(0.01, min(wake, deadline) - now))
+
+    def _pick(self, now):
+        candidates = [k for k in self._keys if k.available(now)]
+        if not candidates:
+            return None
+        if self.strategy == "weighted":
+            # Smooth weighted round robin
+            total = sum(k.weight for k in candidates)
+            for k in candidates:
+                k.current += k.weight
+            best = max(candidates, key=lambda k: k.current)
+            best.current -= total
+            return best
+        return min(candidates, key=lambda k: (k.outstanding / k.weight, k.stats["requests"]))
+
+    def release(self, api_key, status, delay=None):
+        # status is the HTTP status of the response, or None if it never arrived
+        key = self._by_key.get(api_key)
+        if key is None:
+            return
+        with self._cond:
+            key.outstanding -= 1
+            was_probe, key.probing = key.probing, False
+            if status in EJECT_STATUSES:
+                key.stats[str(status)] += 1
+                key.stats["ejections"] += 1
+                if status == 429:
+                    seconds = delay or KEY_THROTTLE_SECONDS
+                else:
+                    # Unauthorized or out of credits won't fix itself quickly, back off harder each time
+                    seconds = min(KEY_EJECT_MAX, key.eject_seconds * 2 if was_probe and key.eject_seconds else KEY_EJECT_SECONDS)
+                    key.eject_seconds = seconds
+                key.ejected_until = time.monotonic() + seconds
+            elif status is not None and status < 500:
+                if status == 200:
+                    key.stats["ok"] += 1
+                key.ejected_until = 0.0
+                key.eject_seconds = 0.0
+            self._cond.notify_all()
+
+    def stats(self):
+        now = time.monotonic()
+        with self._cond:
+            return {
+                k.label: dict(
+                    k.stats,
+                    weight=k.weight,
+                    outstanding=k.outstanding,
+                    state="probing" if k.probing else "ejected" if now < k.ejected_until else "active",
+                    ejected_for=max(0.0, k.ejected_until - now),
+                )
+                for k in self._keys
+            }
+
+
+def _load_keys():
+    keys = parse_keys(API_KEYS)
+    if API_KEYS_FILE:
+        with open(API_KEYS_FILE, "r") as f:
+            keys += parse_keys(f.read())
+    return keys
+
+
+_pool = None
+_pool_loaded = False
+_pool_lock = threading.Lock()
+
+
+def get_key_pool():
+    # None unless SAI_API_KEYS or SAI_API_KEYS_FILE lists at least one key
+    global _pool, _pool_loaded
+    if not _pool_loaded:
+        with _pool_lock:
+            if not _pool_loaded:
+                keys = _load_keys()
+                _pool = KeyPool(keys) if keys else None
+                _pool_loaded = True
+    return _pool
@@ -0,0 +1,156 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+METRICS = os.environ.get("SAI_API_METRICS", "logging")
+
+logger = logging.getLogger("sai_api")
+
+
+class CallMetrics:
+    # Timings and sizes for one request, from encode to decode
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.phases = {}
+        self.cpu = {}
+        self.payload_bytes = 0
+        self.response_bytes = 0
+        self.retries = 0
+        self.polls = 0
+        self.status = "ok"
+        # Label of the pooled API key the request was sent with
+        self.api_key = None
+        self.started = time.monotonic()
+
+    @contextmanager
+    def phase(self, name):
+        start, cpu_start = time.monotonic(), time.thread_time()
+        try:
+            yield
+        finally:
+            self.add(name, time.monotonic() - start)
+            self.cpu[name] = self.cpu.get(name, 0.0) + time.thread_time() - cpu_start
+
+    def add(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0.0) + max(0.0, seconds)
+
+    def as_dict(self):
+        return {
+            "endpoint": self.endpoint,
+            "status": self.status,
+            "total": time.monotonic() - self.started,
+            "phases": dict(self.phases),
+            "cpu": dict(self.cpu),
+            "payload_bytes": self.payload_bytes,
+            "response_bytes": self.response_bytes,
+            "retries": self.retries,
+            "polls": self.polls,
+            "api_key": self.api_key,
+        }
+
+    def finish(self, status=None):
+        if status is not None:
+            self.status = status
+        record = self.as_dict()
+        for sink in _sinks:
+            try:
+                sink.emit(record)
+            except Exception:
+                logger.exception("Stability API metrics sink failed")
+
+
+class LoggingSink:
+    def emit(self, record):
+        phases = " ".join(f"{k}={v * 1000:.0f}ms" for k, v in record["phases"].items())
+        logger.info(
+            "%s %s total=%.0fms %s payload=%dB response=%dB retries=%d polls=%d%s",
+            record["endpoint"], record["status"], record["total"] * 1000, phases,
+            record["payload_bytes"], record["response_bytes"], record["retries"], record["polls"],
+            f" key={record['api_key']}" if record.get("api_key") else "",
+        )
+
+
+class JsonlSink:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def emit(self, record):
+        line = json.dumps(dict(record, time=time.time())) + "\n"
+        with self._lock, open(self.path, "a") as f:
+            f.write(line)
+
+
+class PrometheusSink:
+    # Keeps running totals and rewrites a text exposition file, e.g. for the
+    # node_exporter textfile collector
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._counters = {}
+
+    def _inc(self, name, labels, value):
+        key = (name, tuple(sorted(labels.items())))
+        self._counters[key] = self._counters.get(key, 0) + value
+
+    def emit(self, record):
+        endpoint = {"endpoint": record["endpoint"]}
+        with self._lock:
+            self._inc("sai_api_calls_total", dict(endpoint, status=record["status"]), 1)
+            self._inc("sai_api_call_seconds_total", endpoint, record["total"])
+            for phase, seconds in record["phases"].items():
+                self._inc("sai_api_phase_seconds_total", dict(endpoint, phase=phase), seconds)
+            self._inc("sai_api_payload_bytes_total", endpoint, record["payload_bytes"])
+            self._inc("sai_api_response_bytes_total", endpoint, record["response_bytes"])
+            self._inc("sai_api_retries_total", endpoint, record["retries"])
+            self._inc("sai_api_polls_total", endpoint, record["polls"])
+            if record.get("api_key"):
+                self._inc("sai_api_key_calls_total", {"key": record["api_key"], "status": record["status"]}, 1)
+            text = self.render()
+            directory = os.path.dirname(os.path.abspath(self.path))
+            fd, tmp = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+            with os.fdopen(fd, "w") as f:
+                f.write(text)
+            os.replace(tmp, self.path)
+
+    def render(self):
+        lines = []
+        seen = set()
+        for (name, labels), value in sorted(self._counters.items()):
+            if name not in seen:
+                lines.append(f"# TYPE {name} counter")
+                seen.add(name)
+            label_text = ",".join(f'{k}="{v}"' for k, v in labels)
+            lines.append(f"{name}{{{label_text}}} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _sinks_from_env(value):
+    sinks = []
+    for spec in filter(None, (part.strip() for part in value.split(","))):
+        kind, _, path = spec.partition(":")
+        if kind == "logging":
+            sinks.append(LoggingSink())
+        elif kind == "jsonl":
+            sinks.append(JsonlSink(path or "sai_api_metrics.jsonl"))
+        elif kind == "prometheus":
+            sinks.append(PrometheusSink(path or "sai_api_metrics.prom"))
+        elif kind != "none":
+            logger.warning("Unknown SAI_API_METRICS sink '%s'", kind)
+    return sinks
+
+
+_sinks = _sinks_from_env(METRICS)
+
+
+def add_sink(sink):
+    _sinks.append(sink)
+
+
+def remove_sink(sink):
+    if sink in _sinks:
+        _sinks.remove(sink)
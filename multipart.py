@@ -0,0 +1,181 @@
+import io
+import os
+import queue
+import threading
+import time
+import uuid
+
+STREAM_UPLOAD = os.environ.get("SAI_API_STREAM_UPLOAD", "1").lower() in ("1", "true", "yes")
+STREAM_CHUNK_SIZE = int(os.environ.get("SAI_API_STREAM_CHUNK_SIZE", 64 * 1024))
+STREAM_BUFFER_CHUNKS = int(os.environ.get("SAI_API_STREAM_BUFFER_CHUNKS", 4))
+# Streamed uploads up to this size are kept for on_complete; larger ones are
+# not, so the upload still only holds a few chunks at a time
+STREAM_MEMO_MAX_BYTES = int(os.environ.get("SAI_API_STREAM_MEMO_MAX_BYTES", 4 * 1024 ** 2))
+
+
+class LazyUpload:
+    # A file part that is encoded only while the request body is being sent.
+    # write(fp) must write the full encoded file to fp and may be called again
+    # if the request is retried; fingerprint() identifies the content without
+    # encoding it. on_complete, if given, receives the encoded bytes once a
+    # full pass has been sent, if they are no larger than STREAM_MEMO_MAX_BYTES.
+    def __init__(self, write, fingerprint, on_complete=None):
+        self.write = write
+        self.fingerprint = fingerprint
+        self.on_complete = on_complete
+        self.encode_seconds = 0.0
+
+    def chunks(self):
+        buffer = queue.Queue(maxsize=STREAM_BUFFER_CHUNKS)
+        cancelled = threading.Event()
+        writer = _QueueWriter(buffer, cancelled)
+        done = object()
+
+        def produce():
+            start = time.monotonic()
+            try:
+                self.write(writer)
+                writer.flush()
+                result = done
+            except BaseException as e:
+                result = e
+            self.encode_seconds += time.monotonic() - start
+            if not cancelled.is_set():
+                buffer.put(result)
+
+        threading.Thread(target=produce, name="sai-api-encode", daemon=True).start()
+        sent = [] if self.on_complete is not None else None
+        sent_bytes = 0
+        try:
+            while True:
+                item = buffer.get()
+                if item is done:
+                    if sent is not None:
+                        self.on_complete(b"".join(sent))
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                if sent is not None:
+                    sent_bytes += len(item)
+                    if sent_bytes > STREAM_MEMO_MAX_BYTES:
+                        sent = None
+                    else:
+                        sent.append(item)
+                yield item
+        finally:
+            # If the upload was abandoned, unblock the encoder so it can stop
+            cancelled.set()
+            while not buffer.empty():
+                buffer.get_nowait()
+
+    def getvalue(self):
+        fp = io.BytesIO()
+        self.write(fp)
+        return fp.getvalue()
+
+
+class EncodedUpload:
+    # A file part that is already encoded, e.g. from the payload cache. It
+    # carries the same fingerprint() as the LazyUpload it stands in for, so a
+    # request has one key whichever of the two is sent
+    def __init__(self, content, fingerprint):
+        self.content = content
+        self.fingerprint = fingerprint
+
+
+class _QueueWriter(io.RawIOBase):
+    # File object handed to the encoder; collects writes into chunks and blocks
+    # once the consumer is STREAM_BUFFER_CHUNKS behind
+    def __init__(self, buffer, cancelled):
+        self.buffer = buffer
+        self.cancelled = cancelled
+        self.pending = bytearray()
+
+    def _put(self, chunk):
+        while True:
+            if self.cancelled.is_set():
+                raise IOError("Upload cancelled")
+            try:
+                self.buffer.put(chunk, timeout=0.5)
+                return
+            except queue.Full:
+                pass
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.pending += b
+        while len(self.pending) >= STREAM_CHUNK_SIZE:
+            self._put(bytes(self.pending[:STREAM_CHUNK_SIZE]))
+            del self.pending[:STREAM_CHUNK_SIZE]
+        return len(b)
+
+    def flush(self):
+        if self.pending and not self.cancelled.is_set():
+            self._put(bytes(self.pending))
+            self.pending = bytearray()
+
+
+def part_digest(value, hasher):
+    if isinstance(value, (LazyUpload, EncodedUpload)):
+        return value.fingerprint()
+    return hasher(value).digest()
+
+
+class MultipartStream:
+    # Iterable multipart/form-data body, laid out the same way requests does it.
+    # The total length is only known, and exposed as `len`, when no part is lazy.
+    def __init__(self, fields, files):
+        self.boundary = uuid.uuid4().hex
+        self.content_type = f"multipart/form-data; boundary={self.boundary}"
+        self.parts = []
+        for name, value in (fields or {}).items():
+            values = value if isinstance(value, (list, tuple)) else [value]
+            for v in values:
+                if v is None:
+                    continue
+                if not isinstance(v, bytes):
+                    v = str(v).encode("utf-8")
+                self.parts.append((self._header(name), v))
+        for name, value in (files or {}).items():
+            if value is None:
+                continue
+            if isinstance(value, EncodedUpload):
+                value = value.content
+            self.parts.append((self._header(name, name), value))
+        self.closing = f"--{self.boundary}--\r\n".encode()
+        self.bytes_sent = 0
+        self.finished = None
+        if not any(isinstance(v, LazyUpload) for _, v in self.parts):
+            self.len = sum(len(h) + len(v) + 2 for h, v in self.parts) + len(self.closing)
+
+    def _header(self, name, filename=None):
+        disposition = f'form-data; name="{name}"'
+        if filename is not None:
+            disposition += f'; filename="{filename}"'
+        return f"--{self.boundary}\r\nContent-Disposition: {disposition}\r\n\r\n".encode()
+
+    @property
+    def encode_seconds(self):
+        return sum(v.encode_seconds for _, v in self.parts if isinstance(v, LazyUpload))
+
+    def __iter__(self):
+        # Restartable, so a retried request sends (and re-encodes) the body again
+        self.bytes_sent = 0
+        self.finished = None
+        for header, value in self.parts:
+            yield from self._sent(header)
+            if isinstance(value, LazyUpload):
+                for chunk in value.chunks():
+                    yield from self._sent(chunk)
+            else:
+                for i in range(0, len(value), STREAM_CHUNK_SIZE):
+                    yield from self._sent(value[i:i + STREAM_CHUNK_SIZE])
+            yield from self._sent(b"\r\n")
+        yield from self._sent(self.closing)
+        self.finished = time.monotonic()
+
+    def _sent(self, chunk):
+        self.bytes_sent += len(chunk)
+        yield chunk
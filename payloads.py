@@ -0,0 +1,123 @@
+import os
+import threading
+import weakref
+from collections import OrderedDict
+
+PAYLOAD_CACHE_BYTES = int(os.environ.get("SAI_API_PAYLOAD_CACHE_BYTES", 256 * 1024 ** 2))
+
+
+def _identity(tensor):
+    # Ignore a leading batch dimension of one so a [1,H,W,C] result and its
+    # [H,W,C] or batch-sliced views resolve to the same entry
+    shape, stride = tuple(tensor.shape), tuple(tensor.stride())
+    if len(shape) == 4 and shape[0] == 1:
+        shape, stride = shape[1:], stride[1:]
+    return (tensor.device.type, tensor.data_ptr(), shape, stride, tensor.dtype)
+
+
+class PayloadCache:
+    # Two layers: the original response bytes of tensors that came straight from
+    # the API, so chaining nodes uploads them without re-encoding, and a bounded
+    # LRU of encoded uploads keyed by content fingerprint. Both count against
+    # max_bytes; encoded uploads are evicted first, then the oldest sources.
+    def __init__(self, max_bytes=PAYLOAD_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._encoded = OrderedDict()
+        self._sources = OrderedDict()
+        # id(content) -> [content, references]; rebound batches share the same bytes
+        self._source_bytes = {}
+        self._lock = threading.Lock()
+        self._stats = {"source_hits": 0, "hits": 0, "misses": 0, "evictions": 0, "source_evictions": 0}
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def remember(self, tensor, content, base=None):
+        if not self.enabled or len(content) > self.max_bytes:
+            return
+        key = _identity(tensor)
+        # _version changes whenever the tensor is modified in place
+        with self._lock:
+            self._drop_source(key)
+            self._sources[key] = (content, tensor._version)
+            ref = self._source_bytes.setdefault(id(content), [content, 0])
+            if ref[1] == 0:
+                self.size += len(content)
+            ref[1] += 1
+            self._shrink()
+        weakref.finalize(base if base is not None else tensor, self._forget, key)
+
+    def rebind(self, parts, merged):
+        # Results that were concatenated into a batch keep their source bytes
+        for i, part in enumerate(parts):
+            content = self.source(part, count=False)
+            if content is not None:
+                self.remember(merged[i:i + 1], content, base=merged)
+
+    def source(self, tensor, count=True):
+        if not self.enabled:
+            return None
+        key = _identity(tensor)
+        with self._lock:
+            entry = self._sources.get(key)
+            if entry is None or entry[1] != tensor._version:
+                return None
+            if count:
+                self._stats["source_hits"] += 1
+            return entry[0]
+
+    def get(self, fingerprint):
+        with self._lock:
+            content = self._encoded.get(fingerprint)
+            if content is None:
+                self._stats["misses"] += 1
+                return None
+            self._encoded.move_to_end(fingerprint)
+            self._stats["hits"] += 1
+            return content
+
+    def put(self, fingerprint, content):
+        if len(content) > self.max_bytes:
+            return
+        with self._lock:
+            if fingerprint in self._encoded:
+                return
+            self._encoded[fingerprint] = content
+            self.size += len(content)
+            self._shrink()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, bytes=self.size, entries=len(self._encoded), sources=len(self._sources))
+
+    def _shrink(self):
+        while self.size > self.max_bytes and self._encoded:
+            _, evicted = self._encoded.popitem(last=False)
+            self.size -= len(evicted)
+            self._stats["evictions"] += 1
+        while self.size > self.max_bytes and self._sources:
+            self._drop_source(next(iter(self._sources)))
+            self._stats["source_evictions"] += 1
+
+    def _drop_source(self, key):
+        entry = self._sources.pop(key, None)
+        if entry is None:
+            return
+        ref = self._source_bytes[id(entry[0])]
+        ref[1] -= 1
+        if ref[1] == 0:
+            del self._source_bytes[id(entry[0])]
+            self.size -= len(entry[0])
+
+    def _forget(self, key):
+        with self._lock:
+            self._drop_source(key)
+
+
+_payloads = PayloadCache()
+
+
+def get_payload_cache():
+    return _payloads
@@ -0,0 +1,186 @@
+import heapq
+import itertools
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import Future
+
+from .transport import get_session
+from .scheduler import get_scheduler, retry_after, should_retry
+
+POLL_INITIAL_INTERVAL = float(os.environ.get("SAI_API_POLL_INITIAL", 1.5))
+POLL_MAX_INTERVAL = float(os.environ.get("SAI_API_POLL_MAX_INTERVAL", 10.0))
+POLL_BACKOFF = float(os.environ.get("SAI_API_POLL_BACKOFF", 1.6))
+POLL_JITTER = float(os.environ.get("SAI_API_POLL_JITTER", 0.2))
+POLL_TIMEOUT = float(os.environ.get("SAI_API_POLL_TIMEOUT", 240))
+# Per request, so a stalled connection can't hold up the other jobs
+POLL_REQUEST_TIMEOUT = float(os.environ.get("SAI_API_POLL_REQUEST_TIMEOUT", 30))
+
+logger = logging.getLogger("sai_api")
+
+
+class GenerationFailed(Exception):
+    # The server reported an error for the generation, polling again won't help
+    pass
+
+
+class PollResult:
+    def __init__(self, response, polls, elapsed):
+        self.response = response
+        self.polls = polls
+        self.elapsed = elapsed
+
+
+class _PollJob:
+    def __init__(self, url, headers, deadline):
+        self.url = url
+        self.headers = headers
+        self.deadline = deadline
+        self.started = time.monotonic()
+        self.interval = POLL_INITIAL_INTERVAL
+        self.polls = 0
+        self.future = Future()
+
+
+def _error_info(response):
+    try:
+        return response.json()
+    except ValueError:
+        return f"{response.status_code} {response.text[:200]}"
+
+
+class Poller:
+    # Polls any number of outstanding generation ids from a single background thread.
+    # Jobs sit in a heap ordered by their next check time.
+
+    def __init__(self):
+        self._heap = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stats = {"completed": 0, "failed": 0, "polls": 0, "time_to_ready": 0.0}
+
+    def submit(self, url, headers, timeout=None):
+        # The finished response is streamed: its body is left unread for the
+        # caller, so a large download never holds up the polling thread
+        timeout = POLL_TIMEOUT if timeout is None else timeout
+        job = _PollJob(url, dict(headers), time.monotonic() + timeout)
+        self._schedule(job, self._next_delay(job))
+        return job.future
+
+    def pending(self):
+        with self._cond:
+            return len(self._heap)
+
+    def stats(self):
+        with self._cond:
+            return dict(self._stats)
+
+    def _finish(self, job, result=None, error=None):
+        with self._cond:
+            self._stats["polls"] += job.polls
+            if error is None:
+                self._stats["completed"] += 1
+                self._stats["time_to_ready"] += result.elapsed
+            else:
+                self._stats["failed"] += 1
+        if not job.future.set_running_or_notify_cancel():
+            # Cancelled by the caller, nobody will read the response
+            if result is not None:
+                result.response.close()
+            return
+        if error is None:
+            job.future.set_result(result)
+        else:
+            job.future.set_exception(error)
+
+    def _next_delay(self, job):
+        delay = job.interval * random.uniform(1 - POLL_JITTER, 1 + POLL_JITTER)
+        job.interval = min(job.interval * POLL_BACKOFF, POLL_MAX_INTERVAL)
+        return delay
+
+    def _schedule(self, job, delay):
+        due = min(time.monotonic() + delay, job.deadline)
+        with self._cond:
+            heapq.heappush(self._heap, (due, next(self._counter), job))
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="sai-api-poller", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                due, _, job = self._heap[0]
+                now = time.monotonic()
+                if due > now:
+                    self._cond.wait(due - now)
+                    continue
+                heapq.heappop(self._heap)
+            # One job's failure must not stop polling for all the others
+            try:
+                self._poll(job)
+            except Exception as e:
+                logger.exception("Stability API poller failed on %s", job.url)
+                if not job.future.done():
+                    self._finish(job, error=e)
+
+    def _poll(self, job):
+        scheduler = get_scheduler()
+        api_key = job.headers.get("Authorization")
+        try:
+            # Never sleep on the rate limit here, that would stall every job
+            wait, probe = scheduler.try_acquire(api_key)
+            if wait > 0:
+                if time.monotonic() >= job.deadline:
+                    self._finish(job, error=Exception("Stability API Timeout: Request took too long to complete"))
+                else:
+                    self._schedule(job, wait)
+                return
+            job.polls += 1
+            try:
+                response = get_session().get(job.url, headers=job.headers, stream=True, timeout=POLL_REQUEST_TIMEOUT)
+                if response.status_code != 200:
+                    # Small JSON body, reading it hands the connection back to the pool
+                    response.content
+            finally:
+                if probe:
+                    scheduler.breaker.end_probe()
+        except Exception as e:
+            if time.monotonic() >= job.deadline:
+                self._finish(job, error=e)
+            else:
+                self._schedule(job, self._next_delay(job))
+            return
+
+        if response.status_code in (200, 202):
+            scheduler.breaker.record_success()
+
+        if response.status_code == 200:
+            self._finish(job, PollResult(response, job.polls, time.monotonic() - job.started))
+        elif time.monotonic() >= job.deadline:
+            self._finish(job, error=Exception("Stability API Timeout: Request took too long to complete"))
+        elif response.status_code == 202:
+            self._schedule(job, self._next_delay(job))
+        elif should_retry(response, True):
+            scheduler.observe(api_key, response)
+            self._schedule(job, max(retry_after(response) or 0, self._next_delay(job)))
+        else:
+            self._finish(job, error=GenerationFailed(f"Stability API Error: {_error_info(response)}"))
+
+
+_poller = None
+_poller_lock = threading.Lock()
+
+
+def get_poller():
+    global _poller
+    if _poller is None:
+        with _poller_lock:
+            if _poller is None:
+                _poller = Poller()
+    return _poller
@@ -0,0 +1,225 @@
+import os
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+import requests
+
+RATE_PER_SECOND = float(os.environ.get("SAI_API_RATE_PER_SECOND", 15))
+RATE_BURST = float(os.environ.get("SAI_API_RATE_BURST", 15))
+MAX_RETRIES = int(os.environ.get("SAI_API_MAX_RETRIES", 5))
+RETRY_BASE = float(os.environ.get("SAI_API_RETRY_BASE", 1.0))
+RETRY_MAX = float(os.environ.get("SAI_API_RETRY_MAX", 30.0))
+BREAKER_THRESHOLD = int(os.environ.get("SAI_API_BREAKER_THRESHOLD", 5))
+BREAKER_COOLDOWN = float(os.environ.get("SAI_API_BREAKER_COOLDOWN", 30.0))
+
+# A POST that got one of these was not processed, so it can be sent again.
+# Anything else in the 5xx range may have been, including a gateway 502/504
+# in front of a generation the backend already accepted (and billed), so it
+# is only retried for GETs.
+RETRY_STATUSES = (429, 503)
+
+
+def retry_after(response):
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def should_retry(response, idempotent):
+    return response.status_code in RETRY_STATUSES or (idempotent and response.status_code >= 500)
+
+
+class TokenBucket:
+    def __init__(self, rate=RATE_PER_SECOND, capacity=RATE_BURST):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            wait = self.try_acquire()
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    def try_acquire(self):
+        # Takes a token and returns 0, or returns the seconds until one is available
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if now >= self.blocked_until and self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return max(self.blocked_until - now, (1 - self.tokens) / self.rate)
+
+    def defer(self, seconds):
+        # The server told us to back off, hold every request on this key until then
+        with self._lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+            self.tokens = 0
+
+
+class CircuitBreaker:
+    def __init__(self, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        # Returns True when the caller is the probe; it must call end_probe()
+        # once the probe is over, whatever the outcome
+        with self._lock:
+            if self.opened_at is None:
+                return False
+            remaining = self.opened_at + self.cooldown - time.monotonic()
+            if remaining <= 0 and not self.probing:
+                # Let a single request through to find out if the service is back
+                self.probing = True
+                return True
+        raise Exception(f"Stability API Error: Service unavailable after {self.failures} consecutive failures. Retrying in {max(0, int(remaining))}s.")
+
+    def end_probe(self):
+        # Outcomes that say nothing about the service (e.g. a 429) leave the
+        # circuit open, and the next request after the cooldown probes again
+        with self._lock:
+            self.probing = False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.probing or self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+            self.probing = False
+
+
+class RequestScheduler:
+    def __init__(self):
+        self.breaker = CircuitBreaker()
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._stats = {"requests": 0, "retries": 0, "throttled": 0, "failures": 0}
+
+    def bucket(self, api_key):
+        with self._lock:
+            if api_key not in self._buckets:
+                self._buckets[api_key] = TokenBucket()
+            return self._buckets[api_key]
+
+    def acquire(self, api_key):
+        # Returns True when this request is the circuit breaker's probe
+        probe = self.breaker.allow()
+        try:
+            self.bucket(api_key).acquire()
+        except BaseException:
+            if probe:
+                self.breaker.end_probe()
+            raise
+        self._count("requests")
+        return probe
+
+    def try_acquire(self, api_key):
+        # Non-blocking acquire for the poller: (seconds to wait, 0 once a token
+        # was taken, and whether this request is the circuit breaker's probe)
+        wait = self.bucket(api_key).try_acquire()
+        if wait > 0:
+            return wait, False
+        probe = self.breaker.allow()
+        self._count("requests")
+        return 0.0, probe
+
+    def request(self, api_key, send, idempotent=False, metrics=None, retry_throttled=True):
+        # retry_throttled=False hands 429s back to the caller, e.g. to try another key
+        attempt = 0
+        while True:
+            probe = self.acquire(api_key)
+            try:
+                try:
+                    response = send()
+                finally:
+                    if probe:
+                        self.breaker.end_probe()
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self.breaker.record_failure()
+                self._count("failures")
+                # A read timeout on a POST may still have started a paid generation
+                if attempt >= MAX_RETRIES or (not idempotent and isinstance(e, requests.ReadTimeout)):
+                    raise
+                self._backoff(attempt, metrics=metrics)
+                attempt += 1
+                continue
+
+            if not should_retry(response, idempotent):
+                if response.status_code >= 500:
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.record_success()
+                return response
+
+            self.observe(api_key, response)
+            if attempt >= MAX_RETRIES or (response.status_code == 429 and not retry_throttled):
+                return response
+            response.close()
+            self._backoff(attempt, retry_after(response), metrics)
+            attempt += 1
+
+    def observe(self, api_key, response):
+        if response.status_code == 429:
+            self._count("throttled")
+            delay = retry_after(response)
+            if delay:
+                self.bucket(api_key).defer(delay)
+        elif response.status_code >= 500:
+            self.breaker.record_failure()
+            self._count("failures")
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+    def _backoff(self, attempt, delay=None, metrics=None):
+        self._count("retries")
+        if metrics is not None:
+            metrics.retries += 1
+        if delay is None:
+            delay = min(RETRY_MAX, RETRY_BASE * 2 ** attempt) * random.uniform(0.5, 1.0)
+        time.sleep(delay)
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = RequestScheduler()
+    return _scheduler
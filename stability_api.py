@@ -1,40 +1,52 @@
-import requests
-from requests.models import PreparedRequest
-from PIL import Image
-import numpy as np
-import torch
-from torchvision.transforms import ToPILImage
-from io import BytesIO
+# Keep this module import-light: torch, torchvision, numpy, PIL and requests are only
+# loaded on the first call so registering the nodes stays cheap
+from concurrent.futures import ThreadPoolExecutor
 import os
-import time
 
-ROOT_API = "https://api.stability.ai/v2beta/"
-API_KEY = os.environ.get("SAI_API_KEY")
+from .client import RESULTS_ENDPOINT, abandon_job, cache_lookup, cache_put, coalesced, default_api_key, end_job, poll, read, release_job, send, shape_data, start_job
+# get_api_key used to be defined here, keep importing it from this module working
+from .client import get_api_key  # noqa: F401
+from .capabilities import AUTO_DOWNSCALE, DEFAULT, ONE_MEGAPIXEL_OUTPUT, Capability
+from .metrics import CallMetrics
+from .multipart import EncodedUpload, LazyUpload, STREAM_UPLOAD
+from .payloads import get_payload_cache
 
-def get_api_key():
-    global API_KEY
-    if API_KEY is not None:
-        return API_KEY
+MAX_CONCURRENCY = int(os.environ.get("SAI_API_MAX_CONCURRENCY", 4))
+SWEEP_MAX = int(os.environ.get("SAI_API_SWEEP_MAX", 256))
+SEED_MAX = 4294967294
+MAX_TILES = int(os.environ.get("SAI_API_MAX_TILES", 64))
+TILE_INPUTS = ("tiled", "tile_size", "tile_overlap")
+IMAGE_INPUTS = ("image", "subject_image", "background_reference", "light_reference")
+BATCH_INPUTS = ("image", "mask", "subject_image", "background_reference", "light_reference")
 
-    # Check for API key in file as a backup, not recommended
-    try:
-        if not API_KEY:
-            dir_path = os.path.dirname(os.path.realpath(__file__))
-            with open(os.path.join(dir_path, "sai_platform_key.txt"), "r") as f:
-                API_KEY = f.read().strip()
-            # Validate the key is not empty
-            if API_KEY.strip() == "":
-                raise Exception(f"API Key is required to use the Stability API. \nPlease set the SAI_API_KEY environment variable to your API key or place in {dir_path}/sai_platform_key.txt.")
+class StabilityJob:
+    # Handle for generations that were submitted but not fetched yet. Each entry
+    # holds either a generation id or, when it came from the cache, the content.
+    def __init__(self, api_key, accept, entries):
+        self.api_key = api_key
+        self.accept = accept
+        self.entries = entries
 
-    except Exception as e:
-        print(f"\n\n***API Key is required to use the Stability API. Please set the SAI_API_KEY environment variable to your API key or place in {dir_path}/sai_platform_key.txt.***\n\n")
+    @staticmethod
+    def merge(jobs):
+        return StabilityJob(jobs[0].api_key, jobs[0].accept, [e for job in jobs for e in job.entries])
 
-    return API_KEY
+    def __len__(self):
+        return len(self.entries)
 
 class StabilityBase:
     API_ENDPOINT = ""
     POLL_ENDPOINT = ""
     ACCEPT = ""
+    # None uses the encoder defaults from SAI_API_UPLOAD_*
+    UPLOAD_FORMAT = None
+    UPLOAD_COMPRESS_LEVEL = None
+    UPLOAD_QUALITY = None
+    SUBMIT_ONLY = False
+    # Stream the response to a file and return a list with its path instead of
+    # decoding it; video responses always are
+    TO_FILE = False
+    CAPABILITIES = DEFAULT
 
     @classmethod
     def INPUT_TYPES(cls):
@@ -45,150 +57,265 @@ class StabilityBase:
     CATEGORY = "Stability"
 
     def call(self, *args, **kwargs):
+        tiling = {name: kwargs.pop(name) for name in TILE_INPUTS if name in kwargs}
+        call_item = self._call_single
+        if tiling.get("tiled"):
+            call_item = lambda *a, **kw: self._call_tiled(tiling.get("tile_size", 1024), tiling.get("tile_overlap", 64), *a, **kw)
 
-        buffered = BytesIO()
-        files = {'none': None}
-        data = None
-
-        image = kwargs.get('image', None)
-        if image is not None:
-            if self.API_ENDPOINT != "stable-image/control/style":
-                kwargs["mode"] = "image-to-image"
-                kwargs.pop("aspect_ratio", None)
-            image = ToPILImage()(image.squeeze(0).permute(2,0,1))
-            image.save(buffered, format="PNG")
-            files = self._get_files(buffered, **kwargs)
-        else:
-            kwargs.pop("strength", None)
-        
-        image_subject = kwargs.get('subject_image', None)
-        if image_subject is not None:
-            buffered_sub = BytesIO() 
-            image_subject = ToPILImage()(image_subject.squeeze(0).permute(2,0,1))
-            image_subject.save(buffered_sub, format="PNG")
-            files["subject_image"] = buffered_sub.getvalue()
-        
-        image_bg_ref = kwargs.get('background_reference', None)
-        if image_bg_ref is not None:
-            buffered_bg_ref = BytesIO()
-            image_bg_ref = ToPILImage()(image_bg_ref.squeeze(0).permute(2,0,1))
-            image_bg_ref.save(buffered_bg_ref, format="PNG")
-            files["background_reference"] = buffered_bg_ref.getvalue()
-        
-        image_lt_ref = kwargs.get('light_reference', None)
-        if image_lt_ref is not None:
-            buffered_lt_ref = BytesIO()
-            image_lt_ref = ToPILImage()(image_lt_ref.squeeze(0).permute(2,0,1))
-            image_lt_ref.save(buffered_lt_ref, format="PNG")
-            files["light_reference"] = buffered_lt_ref.getvalue()
+        batch_size = self._batch_size(kwargs)
+        if batch_size == 1:
+            return call_item(*args, **kwargs)
+
+        def run(i):
+            return call_item(*args, **self._batch_item(kwargs, i))[0]
+
+        with ThreadPoolExecutor(max_workers=min(MAX_CONCURRENCY, batch_size)) as pool:
+            results = list(pool.map(run, range(batch_size)))
+        return (self._merge(results),)
+
+    def _batch_size(self, kwargs):
+        sizes = set()
+        for name in BATCH_INPUTS:
+            value = kwargs.get(name, None)
+            if value is None:
+                continue
+            if name == "mask" and value.dim() < 3:
+                continue
+            if value.shape[0] > 1:
+                sizes.add(value.shape[0])
+        if len(sizes) > 1:
+            raise Exception(f"Stability API Error: Batch sizes of the inputs do not match: {sorted(sizes)}")
+        return sizes.pop() if sizes else 1
+
+    def _batch_item(self, kwargs, i):
+        item = dict(kwargs)
+        for name in BATCH_INPUTS:
+            value = item.get(name, None)
+            if value is None:
+                continue
+            if name == "mask" and value.dim() < 3:
+                continue
+            if value.shape[0] > 1:
+                item[name] = value[i:i + 1]
+        return item
+
+    def _call_tiled(self, tile_size, overlap, *args, **kwargs):
+        # Upscale overlapping tiles concurrently and feather blend them back together
+        from .tiling import resize, split_tiles, stitch, tile_count
+        image = kwargs["image"]
+        _, height, width, _ = image.shape
+        # Every tile is a billed request
+        count = tile_count(height, width, tile_size, overlap)
+        if count > MAX_TILES:
+            raise Exception(f"Stability API Error: Bad request.\n\n{width}x{height} needs {count} tiles of {tile_size} with {overlap} overlap, more than SAI_API_MAX_TILES ({MAX_TILES}). Use a larger tile_size or a smaller tile_overlap.")
+        tiles = split_tiles(image, tile_size, overlap)
+
+        def run(tile):
+            y, x, view = tile
+            h, w = view.shape[1], view.shape[2]
+            in_h, in_w = self.CAPABILITIES.fit(h, w)
+            result = self._call_single(*args, **dict(kwargs, image=resize(view, in_h, in_w)))[0]
+            return (y, x, h, w, result)
+
+        with ThreadPoolExecutor(max_workers=min(MAX_CONCURRENCY, len(tiles))) as pool:
+            results = list(pool.map(run, tiles))
+        _, _, _, w, first = results[0]
+        scale = first.shape[2] / w
+        return (stitch(results, height, width, scale, overlap),)
+
+    def _fit_inputs(self, kwargs):
+        # Check image inputs against the endpoint before any network I/O and
+        # shrink them to the largest size the endpoint can use
+        capability = self.CAPABILITIES
+        for name in IMAGE_INPUTS:
+            image = kwargs.get(name, None)
+            if image is None:
+                continue
+            height, width = image.shape[1], image.shape[2]
+            capability.validate(name, height, width)
+            target = capability.fit(height, width, useful=AUTO_DOWNSCALE)
+            if target == (height, width):
+                continue
+            if not AUTO_DOWNSCALE:
+                raise Exception(f"Stability API Error: Bad request.\n\n{name} is {width}x{height}, larger than the {capability.max_pixels} pixels this endpoint accepts")
+
+            from .tiling import resize
+            kwargs[name] = resize(image, *target)
+            mask = kwargs.get("mask", None)
+            if name == "image" and mask is not None:
+                resized = resize(mask.reshape(-1, height, width)[..., None], *target)[..., 0]
+                kwargs["mask"] = resized if mask.dim() == 3 else resized[0]
+        return kwargs
+
+    def _call_single(self, *args, **kwargs):
+
+        upload_format = kwargs.pop("upload_format", "default")
+        metrics = CallMetrics(self.API_ENDPOINT)
+        with metrics.phase("resize"):
+            kwargs = self._fit_inputs(kwargs)
+        with metrics.phase("encode"):
+            files = {'none': None}
+            data = None
+
+            image = kwargs.get('image', None)
+            if image is not None:
+                if self.API_ENDPOINT != "stable-image/control/style":
+                    kwargs["mode"] = "image-to-image"
+                    kwargs.pop("aspect_ratio", None)
+                files = self._get_files(self._upload(image, upload_format), **kwargs)
+            else:
+                kwargs.pop("strength", None)
+
+            image_subject = kwargs.get('subject_image', None)
+            if image_subject is not None:
+                files["subject_image"] = self._upload(image_subject, upload_format)
+
+            image_bg_ref = kwargs.get('background_reference', None)
+            if image_bg_ref is not None:
+                files["background_reference"] = self._upload(image_bg_ref, upload_format)
+
+            image_lt_ref = kwargs.get('light_reference', None)
+            if image_lt_ref is not None:
+                files["light_reference"] = self._upload(image_lt_ref, upload_format)
         
-        style = kwargs.get('style', False)
-        if style is False or (self.API_ENDPOINT == "stable-image/generate/sd3" and "sd3-" in kwargs.get('model', "sd3-")):
+        if kwargs.get('style', False) is False:
             kwargs.pop('style_preset', None)
         
         headers = {}
         if kwargs.get("api_key_override"):
             headers["Authorization"] = kwargs.get("api_key_override")
         else:
-            headers["Authorization"] = get_api_key()
+            headers["Authorization"] = default_api_key()
 
         if headers.get("Authorization") is None:
             raise Exception(f"No Stability key set.\n\nUse your Stability AI API key by:\n1. Setting the SAI_API_KEY environment variable to your API key\n2. Placing inside sai_platform_key.txt\n3. Passing the API key as an argument to the function with the key 'api_key_override'")
 
         headers["Accept"] = self.ACCEPT
 
-        data = self._get_data(**kwargs)
-        
-        if self.API_ENDPOINT == "stable-image/generate/sd3" and kwargs.get('model', "sd3-large-turbo") == "sd3-large-turbo":
-            del data['negative_prompt']
+        data = shape_data(self.API_ENDPOINT, self._get_data(**kwargs), files)
         
         if kwargs.get('aspect_ratio', None) is not None:
             data['aspect_ratio'] = data['aspect_ratio'].split("(", 1)[0]
         
-        if kwargs.get('subject_image', None) is not None:
-            if 'subject_image' in data:
-                    del data['subject_image']
-            
-            if 'background_reference' in data:
-                    del data['background_reference']
-            
-            if 'light_reference' in data:
-                    del data['light_reference']
-            
-            if kwargs.get('light_reference', None) is not None:
-                if 'light_source_direction' in data:
-                    del data['light_source_direction']
-            else:
-                if 'light_source_direction' in data and data['light_source_direction'] == 'none':
-                    if 'light_source_strength' in data:
-                        del data['light_source_strength']
-        
-        req = PreparedRequest()
-        req.prepare_method('POST')
-        req.prepare_url(f"{ROOT_API}{self.API_ENDPOINT}", None)
-        req.prepare_headers(headers)
-        req.prepare_body(data=data, files=files)
-        response = requests.Session().send(req)
-        
-        if response.status_code == 200:
-            if self.POLL_ENDPOINT != "":
-                id = response.json().get("id")
-                timeout = 240
-                start_time = time.time()
-                while True:
-                    response = requests.get(f"{ROOT_API}{self.POLL_ENDPOINT}{id}", headers=headers)
-                    if response.status_code == 200:
-                        if self.ACCEPT == "image/*" or self.ACCEPT == "*/*":
-                            return self._return_image(response)
-                        if self.ACCEPT == "video/*":
-                            return self._return_video(response)
-                        break
-                    elif response.status_code == 202:
-                        time.sleep(10)
-                    elif time.time() - start_time > timeout:
-                        raise Exception("Stability API Timeout: Request took too long to complete")
-                    else:
-                        error_info = response.json()
-                        raise Exception(f"Stability API Error: {error_info}")
-            else:
-                result_image = Image.open(BytesIO(response.content))
-                result_image = result_image.convert("RGBA")
-                result_image = np.array(result_image).astype(np.float32) / 255.0
-                result_image = torch.from_numpy(result_image)[None,]
-                return (result_image,)
-        else:
-            error_info = response.json()
-            if error_info.get("name") == "unauthorized":
-                raise Exception("Stability API Error: Unauthorized.\n\nUse your Stability AI API key by:\n1. Setting the SAI_API_KEY environment variable to your API key\n2. Placing inside sai_platform_key.txt\n3. Passing the API key as an argument to the function with the key 'api_key_override'")
-            if error_info.get("name") == "payment_required":
-                raise Exception("Stability API Error: Not enough credits.\n\nPlease ensure your SAI API account has enough credits to complete this action.")
-            if error_info.get("name") == "bad_request":
-                errors = '\n'.join(error_info.get('errors'))
-                raise Exception(f"Stability API Error: Bad request.\n\n{errors}")
-            else:
-                raise Exception(f"Stability API Error: {error_info}")
+        try:
+            result = self._dispatch(headers, data, files, metrics)
+        except Exception:
+            metrics.finish("error")
+            raise
+        metrics.finish()
+        return result
 
-    def _return_image(self, response):
-        result_image = Image.open(BytesIO(response.content))
-        result_image = result_image.convert("RGBA")
-        result_image = np.array(result_image).astype(np.float32) / 255.0
-        result_image = torch.from_numpy(result_image)[None,]
-        return (result_image,)
+    def _dispatch(self, headers, data, files, metrics):
+        cache_key = None
+        content = None
+        to_file = self.TO_FILE or self.ACCEPT == "video/*"
+        if not to_file and self._is_deterministic(data):
+            cache_key, content = cache_lookup(self.API_ENDPOINT, self.ACCEPT, data, files, metrics)
+
+        if self.SUBMIT_ONLY:
+            if content is not None:
+                return (StabilityJob(headers["Authorization"], self.ACCEPT, [{"content": content}]),)
+            id = start_job(self.API_ENDPOINT, headers, data, files, metrics, cache_key)
+            if metrics.status != "resumed":
+                metrics.status = "submitted"
+            return (StabilityJob(headers["Authorization"], self.ACCEPT, [{"id": id, "cache_key": cache_key, "api_key": headers["Authorization"]}]),)
 
-    def _return_video(self, response):
-        result_video = response.content
-        return (result_video,)
+        if to_file:
+            path = self._send(headers, data, files, metrics, to_file=True)
+            metrics.response_bytes = os.path.getsize(path)
+            return ([path],)
+
+        if content is None:
+            def fetch():
+                content = self._send(headers, data, files, metrics, cache_key=cache_key)
+                cache_put(cache_key, content)
+                return content
+            content = coalesced(cache_key, headers, fetch, metrics)
+        metrics.response_bytes = len(content)
+        with metrics.phase("decode"):
+            return self._return_image(content)
+
+    def _encode(self, tensor, fp=None, format=None):
+        from .encoder import encode_image
+        return encode_image(tensor, format or self.UPLOAD_FORMAT, self.UPLOAD_COMPRESS_LEVEL, self.UPLOAD_QUALITY, fp)
+
+    def _upload(self, tensor, upload_format="default"):
+        from .encoder import QuantizedImage
+        payloads = get_payload_cache()
+        format = self.UPLOAD_FORMAT if upload_format == "default" else upload_format
+        # Every path below keys the request on the same fingerprint, which is
+        # only computed when something needs it
+        image = QuantizedImage(tensor, format, self.UPLOAD_COMPRESS_LEVEL, self.UPLOAD_QUALITY)
+        fingerprint = image.fingerprint
+        # A result straight from a previous Stability node is sent as the server's own bytes
+        source = payloads.source(tensor)
+        if source is not None:
+            return EncodedUpload(source, fingerprint)
+
+        remember = None
+        if payloads.enabled:
+            encoded = payloads.get(fingerprint())
+            if encoded is not None:
+                return EncodedUpload(encoded, fingerprint)
+            remember = lambda encoded: payloads.put(fingerprint(), encoded)
+        if not STREAM_UPLOAD:
+            encoded = self._encode(image.pixels(), format=format)
+            if remember is not None:
+                remember(encoded)
+            return EncodedUpload(encoded, fingerprint)
+        # With streaming uploads the image is encoded while the request body is sent
+        return LazyUpload(lambda fp: self._encode(image.pixels(), fp, format), fingerprint, remember)
+
+    def _send(self, headers, data, files, metrics, to_file=False, cache_key=None):
+        return send(self.API_ENDPOINT, headers, data, files, metrics, self.POLL_ENDPOINT != "", to_file, cache_key)
+
+    def _merge(self, results):
+        if self.SUBMIT_ONLY:
+            return StabilityJob.merge(results)
+        if self.TO_FILE:
+            return [path for paths in results for path in paths]
+        import torch
+        merged = torch.cat(results, dim=0)
+        get_payload_cache().rebind(results, merged)
+        return merged
+
+    def _is_deterministic(self, data):
+        # Seed 0 asks the server for a random seed, so the result can't be reused
+        spec = self.INPUT_SPEC
+        if "seed" in spec.get("required", {}) or "seed" in spec.get("optional", {}):
+            return int(data.get("seed", 0) or 0) != 0
+        return True
+
+    def _return_image(self, content):
+        from .decoder import decode_image
+        result_image = decode_image(content)
+        get_payload_cache().remember(result_image, content)
+        return (result_image,)
 
-    def _get_files(self, buffered, **kwargs):
-        return {
-            "image": buffered.getvalue()
+    def _get_files(self, image, **kwargs):
+        files = {
+            "image": image
         }
+        mask = kwargs.get("mask", None)
+        if mask is not None:
+            from .encoder import encode_mask
+            files["mask"] = encode_mask(mask)
+        return files
     
     def _get_data(self, **kwargs):
         return {k: v for k, v in kwargs.items() if k != "image" and k != "mask"}
 
 style_preset_list = ["3d-model", "analog-film", "anime", "cinematic", "comic-book", "digital-art", "enhance", "fantasy-art", "isometric", "line-art", "low-poly", "modeling-compound", "neon-punk", "origami", "photographic", "pixel-art", "tile-texture"]
 output_format_list = ["png", "webp", "jpeg"]
+# Codec for the uploaded images; default follows SAI_API_UPLOAD_FORMAT
+upload_spec = {
+    "upload_format": (["default", "png", "webp", "jpeg"],),
+}
+tile_spec = {
+    "tiled": ("BOOLEAN", {"default": False}),
+    "tile_size": ("INT", {"default": 1024, "min": 256, "max": 4096, "step": 64}),
+    "tile_overlap": ("INT", {"default": 64, "min": 0, "max": 512, "step": 8}),
+}
 
 class StabilityCore(StabilityBase):
     API_ENDPOINT = "stable-image/generate/core"
@@ -212,6 +339,7 @@ class StabilityCore(StabilityBase):
 class StabilityImageUltra(StabilityBase):
     API_ENDPOINT = "stable-image/generate/ultra"
     ACCEPT = "image/*"
+    CAPABILITIES = ONE_MEGAPIXEL_OUTPUT
     INPUT_SPEC = {
         "required": {
             "prompt": ("STRING", {"multiline": True}),
@@ -226,6 +354,7 @@ class StabilityImageUltra(StabilityBase):
             "style_preset": (style_preset_list,),
             "output_format": (output_format_list,),
             "api_key_override": ("STRING", {"multiline": False}),
+            **upload_spec,
         },
     }
 
@@ -233,6 +362,7 @@ class StabilityImageUltra(StabilityBase):
 class StabilityConservativeUpscale(StabilityBase):
     API_ENDPOINT = "stable-image/upscale/conservative"
     ACCEPT = "image/*"
+    CAPABILITIES = Capability(useful_pixels=4_194_304)
     INPUT_SPEC = {
         "required": {
             "image": ("IMAGE",),
@@ -244,6 +374,8 @@ class StabilityConservativeUpscale(StabilityBase):
             "creativity": ("FLOAT", {"default": 0.35, "min": 0.2, "max": 0.5, "step": 0.01}),
             "output_format": (output_format_list,),
             "api_key_override": ("STRING", {"multiline": False}),
+            **upload_spec,
+            **tile_spec,
         }
     }
 
@@ -252,6 +384,7 @@ class StabilityCreativeUpscale(StabilityBase):
     API_ENDPOINT = "stable-image/upscale/creative"
     POLL_ENDPOINT  = "results/"
     ACCEPT = "*/*"
+    CAPABILITIES = Capability(max_pixels=1_048_576)
     INPUT_SPEC = {
         "required": {
             "image": ("IMAGE",),
@@ -265,6 +398,8 @@ class StabilityCreativeUpscale(StabilityBase):
             "style_preset": (style_preset_list,),
             "output_format": (output_format_list,),
             "api_key_override": ("STRING", {"multiline": False}),
+            **upload_spec,
+            **tile_spec,
         }
     }
 
@@ -272,6 +407,7 @@ class StabilityCreativeUpscale(StabilityBase):
 class StabilityRemoveBackground(StabilityBase):
     API_ENDPOINT = "stable-image/edit/remove-background"
     ACCEPT = "image/*"
+    CAPABILITIES = Capability(max_pixels=4_194_304)
     INPUT_SPEC = {
         "required": {
             "image": ("IMAGE",),
@@ -279,6 +415,7 @@ class StabilityRemoveBackground(StabilityBase):
         "optional": {
             "output_format": (output_format_list,),
             "api_key_override": ("STRING", {"multiline": False}),
+            **upload_spec,
         }
     }
 
@@ -300,23 +437,9 @@ class StabilityInpainting(StabilityBase):
             "style_preset": (style_preset_list,),
             "output_format": (output_format_list,),
             "api_key_override": ("STRING", {"multiline": False}),
+            **upload_spec,
         }
     }
-    def _get_files(self, buffered, **kwargs):
-        mask = kwargs.get("mask", None)
-        if mask != None:
-            mask = mask.reshape((-1, 1, mask.shape[-2], mask.shape[-1])).movedim(1, -1).expand(-1, -1, -1, 3)
-            mask = ToPILImage()(mask.squeeze(0).permute(2,0,1))
-            buffered_mask = BytesIO()
-            mask.save(buffered_mask, format="PNG")
-            return {
-                "image": buffered.getvalue(),
-                "mask": buffered_mask.getvalue(),
-            }
-        else:
-            return {
-                "image": buffered.getvalue(),
-            }
 
 
 class StabilityErase(StabilityBase):
@@ -332,23 +455,9 @@ class StabilityErase(StabilityBase):
             "seed": ("INT", {"default": 0, "min": 0, "max": 4294967294}),
             "output_format": (output_format_list,),
             "api_key_override": ("STRING", {"multiline": False}),
+            **upload_spec,
         }
     }
-    def _get_files(self, buffered, **kwargs):
-        mask = kwargs.get("mask", None)
-        if mask != None:
-            mask = mask.reshape((-1, 1, mask.shape[-2], mask.shape[-1])).movedim(1, -1).expand(-1, -1, -1, 3)
-            mask = ToPILImage()(mask.squeeze(0).permute(2,0,1))
-            buffered_mask = BytesIO()
-            mask.save(buffered_mask, format="PNG")
-            return {
-                "image": buffered.getvalue(),
-                "mask": buffered_mask.getvalue(),
-            }
-        else:
-            return {
-                "image": buffered.getvalue(),
-            }
 
 
 class StabilitySearchAndReplace(StabilityBase):
@@ -368,6 +477,7 @@ class StabilitySearchAndReplace(StabilityBase):
             "style_preset": (style_preset_list,),
             "output_format": (output_format_list,),
             "api_key_override": ("STRING", {"multiline": False}),
+            **upload_spec,
         },
     }
 
@@ -375,6 +485,7 @@ class StabilitySearchAndReplace(StabilityBase):
 class StabilitySD3(StabilityBase):
     API_ENDPOINT = "stable-image/generate/sd3"
     ACCEPT = "image/*"
+    CAPABILITIES = ONE_MEGAPIXEL_OUTPUT
     INPUT_SPEC = {
         "required": {
             "model": (["sd3.5-large", "sd3.5-large-turbo", "sd3.5-medium", "sd3-large", "sd3-large-turbo", "sd3-medium"],),
@@ -391,6 +502,7 @@ class StabilitySD3(StabilityBase):
             "style_preset": (style_preset_list,),
             "output_format": (output_format_list,),
             "api_key_override": ("STRING", {"multiline": False}),
+            **upload_spec,
         },
     }
 
@@ -414,12 +526,14 @@ class StabilityOutpainting(StabilityBase):
             "style_preset": (style_preset_list,),
             "output_format": (output_format_list,),
             "api_key_override": ("STRING", {"multiline": False}),
+            **upload_spec,
         },
     }
 
 class StabilityControlSketch(StabilityBase):
     API_ENDPOINT = "stable-image/control/sketch"
     ACCEPT = "image/*"
+    CAPABILITIES = ONE_MEGAPIXEL_OUTPUT
     INPUT_SPEC = {
         "required": {
             "image": ("IMAGE",),
@@ -433,6 +547,7 @@ class StabilityControlSketch(StabilityBase):
             "style_preset": (style_preset_list,),
             "output_format": (output_format_list,),
             "api_key_override": ("STRING", {"multiline": False}),
+            **upload_spec,
         },
     }
 
@@ -440,6 +555,7 @@ class StabilityControlSketch(StabilityBase):
 class StabilityControlStructure(StabilityBase):
     API_ENDPOINT = "stable-image/control/structure"
     ACCEPT = "image/*"
+    CAPABILITIES = ONE_MEGAPIXEL_OUTPUT
     INPUT_SPEC = {
         "required": {
             "image": ("IMAGE",),
@@ -453,12 +569,14 @@ class StabilityControlStructure(StabilityBase):
             "style_preset": (style_preset_list,),
             "output_format": (output_format_list,),
             "api_key_override": ("STRING", {"multiline": False}),
+            **upload_spec,
         },
     }
 
 class StabilityFastUpscale(StabilityBase):
     API_ENDPOINT = "stable-image/upscale/fast"
     ACCEPT = "image/*"
+    CAPABILITIES = Capability(max_pixels=1_048_576, min_pixels=1_024, min_side=32, max_side=1536)
     INPUT_SPEC = {
         "required": {
             "image": ("IMAGE",),
@@ -466,12 +584,15 @@ class StabilityFastUpscale(StabilityBase):
         "optional": {
             "output_format": (output_format_list,),
             "api_key_override": ("STRING", {"multiline": False}),
+            **upload_spec,
+            **tile_spec,
         }
     }
 
 class StabilityControlStyle(StabilityBase):
     API_ENDPOINT = "stable-image/control/style"
     ACCEPT = "image/*"
+    CAPABILITIES = ONE_MEGAPIXEL_OUTPUT
     INPUT_SPEC = {
         "required": {
             "image": ("IMAGE",),
@@ -486,6 +607,7 @@ class StabilityControlStyle(StabilityBase):
             "style_preset": (style_preset_list,),
             "output_format": (output_format_list,),
             "api_key_override": ("STRING", {"multiline": False}),
+            **upload_spec,
         },
     }
 
@@ -506,6 +628,7 @@ class StabilitySearchAndRecolor(StabilityBase):
             "style_preset": (style_preset_list,),
             "output_format": (output_format_list,),
             "api_key_override": ("STRING", {"multiline": False}),
+            **upload_spec,
         },
     }
 
@@ -531,5 +654,375 @@ class StabilityReplaceRelight(StabilityBase):
             "seed": ("INT", {"default": 0, "min": 0, "max": 4294967294}),
             "output_format": (output_format_list,),
             "api_key_override": ("STRING", {"multiline": False}),
+            **upload_spec,
         }
     }
+
+
+class StabilityCreativeUpscaleSubmit(StabilityCreativeUpscale):
+    SUBMIT_ONLY = True
+    RETURN_TYPES = ("STABILITY_JOB",)
+    INPUT_SPEC = {
+        "required": StabilityCreativeUpscale.INPUT_SPEC["required"],
+        "optional": {k: v for k, v in StabilityCreativeUpscale.INPUT_SPEC["optional"].items() if k not in TILE_INPUTS},
+    }
+
+
+class StabilityReplaceRelightSubmit(StabilityReplaceRelight):
+    SUBMIT_ONLY = True
+    RETURN_TYPES = ("STABILITY_JOB",)
+
+
+class StabilityConservativeUpscaleToFile(StabilityConservativeUpscale):
+    TO_FILE = True
+    RETURN_TYPES = ("STRING",)
+    RETURN_NAMES = ("path",)
+    OUTPUT_IS_LIST = (True,)
+    INPUT_SPEC = {
+        "required": StabilityConservativeUpscale.INPUT_SPEC["required"],
+        "optional": {k: v for k, v in StabilityConservativeUpscale.INPUT_SPEC["optional"].items() if k not in TILE_INPUTS},
+    }
+
+
+class StabilityFastUpscaleToFile(StabilityFastUpscale):
+    TO_FILE = True
+    RETURN_TYPES = ("STRING",)
+    RETURN_NAMES = ("path",)
+    OUTPUT_IS_LIST = (True,)
+    INPUT_SPEC = {
+        "required": StabilityFastUpscale.INPUT_SPEC["required"],
+        "optional": {k: v for k, v in StabilityFastUpscale.INPUT_SPEC["optional"].items() if k not in TILE_INPUTS},
+    }
+
+
+def _abandon(pending):
+    # Generations a failed fetch will no longer wait on
+    for entry, future in pending:
+        if future is not None:
+            abandon_job(entry["id"], future)
+
+
+def _release(pending):
+    # Generations a failed fetch already received but won't return; a later run resumes them
+    for entry, future in pending:
+        if future is not None:
+            release_job(entry["id"])
+
+
+def _complete(pending):
+    for entry, future in pending:
+        if future is not None:
+            end_job(entry["id"])
+
+
+class StabilityFetchResult:
+    INPUT_SPEC = {
+        "required": {
+            "job": ("STABILITY_JOB",),
+        },
+        "optional": {
+            "job_2": ("STABILITY_JOB",),
+            "job_3": ("STABILITY_JOB",),
+            "job_4": ("STABILITY_JOB",),
+        },
+    }
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        return cls.INPUT_SPEC
+
+    # One IMAGE batch per output size
+    RETURN_TYPES = ("IMAGE",)
+    OUTPUT_IS_LIST = (True,)
+    FUNCTION = "call"
+    CATEGORY = "Stability"
+
+    def call(self, job, job_2=None, job_3=None, job_4=None):
+        import torch
+
+        jobs = [j for j in (job, job_2, job_3, job_4) if j is not None]
+        # Start polling every generation before waiting on any of them
+        pending = []
+        for j in jobs:
+            for entry in j.entries:
+                if "content" in entry:
+                    pending.append((entry, None))
+                else:
+                    # Pooled jobs are fetched with the key that submitted them
+                    headers = {"Authorization": entry.get("api_key", j.api_key), "Accept": j.accept}
+                    pending.append((entry, poll(entry['id'], headers)))
+
+        payloads = get_payload_cache()
+        results = []
+        for i, (entry, future) in enumerate(pending):
+            try:
+                results.append(self._fetch(entry, future, payloads))
+            except BaseException:
+                _release(pending[:i + 1])
+                _abandon(pending[i + 1:])
+                raise
+
+        # Jobs can produce different sizes, e.g. upscales of different images,
+        # and those can't share a batch: one batch per size
+        groups = {}
+        for image in results:
+            groups.setdefault(tuple(image.shape[1:]), []).append(image)
+        batches = []
+        for images in groups.values():
+            merged = torch.cat(images, dim=0)
+            payloads.rebind(images, merged)
+            batches.append(merged)
+        # Only now are the results safely handed over
+        _complete(pending)
+        return (batches,)
+
+    def _fetch(self, entry, future, payloads):
+        from .decoder import decode_image
+
+        metrics = CallMetrics(RESULTS_ENDPOINT)
+        try:
+            if future is None:
+                content = entry["content"]
+                metrics.status = "cache_hit"
+            else:
+                with metrics.phase("poll"):
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        end_job(entry["id"], e)
+                        raise
+                metrics.polls = result.polls
+                content = result.response.content
+                cache_put(entry.get("cache_key"), content)
+            metrics.response_bytes = len(content)
+            with metrics.phase("decode"):
+                result_image = decode_image(content)
+        except Exception:
+            metrics.finish("error")
+            raise
+        payloads.remember(result_image, content)
+        metrics.finish()
+        return result_image
+
+
+class StabilityFetchResultToFile:
+    INPUT_SPEC = StabilityFetchResult.INPUT_SPEC
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        return cls.INPUT_SPEC
+
+    RETURN_TYPES = ("STRING",)
+    RETURN_NAMES = ("path",)
+    OUTPUT_IS_LIST = (True,)
+    FUNCTION = "call"
+    CATEGORY = "Stability"
+
+    def call(self, job, job_2=None, job_3=None, job_4=None):
+        jobs = [j for j in (job, job_2, job_3, job_4) if j is not None]
+        pending = []
+        for j in jobs:
+            for entry in j.entries:
+                if "content" in entry:
+                    pending.append((entry, None))
+                else:
+                    # Pooled jobs are fetched with the key that submitted them
+                    headers = {"Authorization": entry.get("api_key", j.api_key), "Accept": j.accept}
+                    pending.append((entry, poll(entry['id'], headers)))
+
+        paths = []
+        for i, (entry, future) in enumerate(pending):
+            try:
+                paths.append(self._fetch(entry, future))
+            except BaseException:
+                _release(pending[:i + 1])
+                _abandon(pending[i + 1:])
+                raise
+        _complete(pending)
+        return (paths,)
+
+    def _fetch(self, entry, future):
+        from .download import save_content
+
+        metrics = CallMetrics(RESULTS_ENDPOINT)
+        if future is None:
+            path = save_content(entry["content"])
+            metrics.status = "cache_hit"
+        else:
+            try:
+                with metrics.phase("poll"):
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        end_job(entry["id"], e)
+                        raise
+                metrics.polls = result.polls
+                path = read(result.response, metrics, to_file=True)
+            except Exception:
+                metrics.finish("error")
+                raise
+        metrics.response_bytes = os.path.getsize(path)
+        metrics.finish()
+        return path
+
+
+class StabilityLoadImageFile:
+    INPUT_SPEC = {
+        "required": {
+            "path": ("STRING", {"multiline": False}),
+        },
+    }
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        return cls.INPUT_SPEC
+
+    RETURN_TYPES = ("IMAGE",)
+    FUNCTION = "call"
+    CATEGORY = "Stability"
+
+    def call(self, path):
+        from .decoder import decode_image
+        # Decoded straight from the file, the encoded bytes are never read into memory
+        return (decode_image(path),)
+
+
+def parse_seeds(text, limit=SWEEP_MAX):
+    # "1-4, 10" -> [1, 2, 3, 4, 10]. Ranges are counted against limit before
+    # they are expanded, so a huge range fails fast instead of filling memory
+    ranges = []
+    for part in filter(None, (p.strip() for p in text.split(","))):
+        start, sep, end = part.partition("-")
+        try:
+            first, last = (int(start), int(end)) if sep else (int(part), int(part))
+        except ValueError:
+            raise Exception(f"Stability API Error: Bad request.\n\nCan't read '{part}' as a seed or a range of seeds like 1-4")
+        if first > last:
+            raise Exception(f"Stability API Error: Bad request.\n\nSeed range '{part}' is reversed, write it as {last}-{first}")
+        if first < 0 or last > SEED_MAX:
+            raise Exception(f"Stability API Error: Bad request.\n\nSeed '{part}' is outside 0-{SEED_MAX}")
+        ranges.append((first, last))
+    count = sum(last - first + 1 for first, last in ranges)
+    if count > limit:
+        raise Exception(f"Stability API Error: Bad request.\n\nThe sweep has {count} seeds, more than SAI_API_SWEEP_MAX ({limit})")
+    return [seed for first, last in ranges for seed in range(first, last + 1)]
+
+
+def parse_list(text):
+    return [p.strip() for p in text.split(",") if p.strip()]
+
+
+class StabilitySweep:
+    ENDPOINTS = {"core": StabilityCore, "ultra": StabilityImageUltra, "sd3": StabilitySD3}
+    INPUT_SPEC = {
+        "required": {
+            "endpoint": (list(ENDPOINTS),),
+            "prompt": ("STRING", {"multiline": True}),
+            "seeds": ("STRING", {"multiline": False, "default": "1-4"}),
+        },
+        "optional": {
+            "style_presets": ("STRING", {"multiline": False, "default": ""}),
+            "models": ("STRING", {"multiline": False, "default": ""}),
+            "aspect_ratios": ("STRING", {"multiline": False, "default": "1:1"}),
+            "negative_prompt": ("STRING", {"multiline": True}),
+            "output_format": (output_format_list,),
+            "max_in_flight": ("INT", {"default": MAX_CONCURRENCY, "min": 1, "max": 64}),
+            "api_key_override": ("STRING", {"multiline": False}),
+        },
+    }
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        return cls.INPUT_SPEC
+
+    # One IMAGE batch per output size, with a JSON list of the parameters of
+    # each image in it
+    RETURN_TYPES = ("IMAGE", "STRING")
+    RETURN_NAMES = ("images", "metadata")
+    OUTPUT_IS_LIST = (True, True)
+    FUNCTION = "call"
+    CATEGORY = "Stability"
+
+    def call(self, endpoint, prompt, seeds, style_presets="", models="", aspect_ratios="1:1", negative_prompt="", output_format="png", max_in_flight=MAX_CONCURRENCY, api_key_override=""):
+        import itertools
+        import json
+        import torch
+
+        node = self.ENDPOINTS[endpoint]
+        optional = node.INPUT_SPEC["optional"]
+        seed_list = parse_seeds(seeds) or [0]
+        presets = parse_list(style_presets) or [None]
+        model_list = parse_list(models) or [None]
+        ratios = self._ratios(optional["aspect_ratio"][0], parse_list(aspect_ratios) or ["1:1"])
+        for preset in presets:
+            if preset is not None and preset not in style_preset_list:
+                raise Exception(f"Stability API Error: Bad request.\n\nUnknown style preset '{preset}'")
+        if model_list != [None]:
+            if endpoint != "sd3":
+                raise Exception("Stability API Error: Bad request.\n\nmodels only applies to the sd3 endpoint")
+            allowed = node.INPUT_SPEC["required"]["model"][0]
+            for model in model_list:
+                if model not in allowed:
+                    raise Exception(f"Stability API Error: Bad request.\n\nUnknown model '{model}', expected one of {allowed}")
+        elif endpoint == "sd3":
+            model_list = [node.INPUT_SPEC["required"]["model"][0][0]]
+
+        def sent(seed, preset, model, ratio):
+            # SD3 models ignore style presets (see shape_data), so those
+            # combinations would repeat the same request
+            if endpoint == "sd3" and "sd3-" in model:
+                preset = None
+            return seed, preset, model, ratio
+
+        grid = list(dict.fromkeys(itertools.starmap(sent, itertools.product(seed_list, presets, model_list, ratios))))
+        if len(grid) > SWEEP_MAX:
+            raise Exception(f"Stability API Error: Bad request.\n\nThe sweep has {len(grid)} combinations, more than SAI_API_SWEEP_MAX ({SWEEP_MAX})")
+
+        def run(params):
+            seed, preset, model, ratio = params
+            kwargs = {
+                "prompt": prompt,
+                "negative_prompt": negative_prompt,
+                "seed": seed,
+                "aspect_ratio": ratio,
+                "style": preset is not None,
+                "style_preset": preset or style_preset_list[0],
+                "output_format": output_format,
+                "api_key_override": api_key_override,
+            }
+            if model is not None:
+                kwargs["model"] = model
+            return node()._call_single(**kwargs)[0]
+
+        with ThreadPoolExecutor(max_workers=min(max_in_flight, len(grid))) as pool:
+            results = list(pool.map(run, grid))
+
+        # Different aspect ratios can't share a batch, so images are grouped by size
+        groups = {}
+        for (seed, preset, model, ratio), image in zip(grid, results):
+            meta = {"endpoint": endpoint, "seed": seed, "style_preset": preset, "aspect_ratio": ratio.split("(", 1)[0]}
+            if model is not None:
+                meta["model"] = model
+            images, metadata = groups.setdefault(tuple(image.shape[1:]), ([], []))
+            images.append(image)
+            metadata.append(meta)
+
+        payloads = get_payload_cache()
+        batches = []
+        for images, _ in groups.values():
+            merged = torch.cat(images, dim=0)
+            payloads.rebind(images, merged)
+            batches.append(merged)
+        return (batches, [json.dumps(metadata) for _, metadata in groups.values()])
+
+    @staticmethod
+    def _ratios(options, requested):
+        # Accept "16:9" as well as the full "16:9(1344, 768)" option
+        by_ratio = {option.split("(", 1)[0]: option for option in options}
+        ratios = []
+        for ratio in requested:
+            option = by_ratio.get(ratio.split("(", 1)[0].strip())
+            if option is None:
+                raise Exception(f"Stability API Error: Bad request.\n\nUnknown aspect ratio '{ratio}', expected one of {list(by_ratio)}")
+            ratios.append(option)
+        return ratios
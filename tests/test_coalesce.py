@@ -0,0 +1,68 @@
+import importlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+
+@pytest.fixture
+def flight(sai_api):
+    return importlib.import_module("sai_api.coalesce").SingleFlight()
+
+
+def run_together(flight, key, fn, callers):
+    # Starts every caller, then lets the leader's fn finish once all have joined
+    release = threading.Event()
+
+    def call(_):
+        return flight.do(key, lambda: (release.wait(5), fn())[1])
+
+    with ThreadPoolExecutor(max_workers=callers) as pool:
+        futures = [pool.submit(call, i) for i in range(callers)]
+        deadline = time.monotonic() + 5
+        while sum(flight.stats()[k] for k in ("leaders", "coalesced")) < callers and time.monotonic() < deadline:
+            time.sleep(0.001)
+        release.set()
+        return [f.exception() or f.result() for f in futures]
+
+
+def test_identical_calls_share_one_request(flight):
+    calls = []
+    results = run_together(flight, "k", lambda: calls.append(1) or "result", 4)
+    assert results == ["result"] * 4
+    assert len(calls) == 1
+    assert flight.stats() == {"leaders": 1, "coalesced": 3, "in_flight": 0}
+
+
+def test_errors_reach_every_caller(flight):
+    def fail():
+        raise ValueError("boom")
+
+    results = run_together(flight, "k", fail, 3)
+    assert all(isinstance(r, ValueError) for r in results)
+
+
+def test_a_new_call_after_the_flight_sends_again(flight):
+    assert flight.do("k", lambda: 1) == 1
+    assert flight.do("k", lambda: 2) == 2
+    assert flight.stats()["leaders"] == 2
+
+
+def test_different_keys_are_not_shared(flight):
+    future_a, leader_a = flight.join("a")
+    future_b, leader_b = flight.join("b")
+    assert leader_a and leader_b and future_a is not future_b
+
+
+def test_a_cancelled_waiter_does_not_break_the_leader(flight):
+    future, leader = flight.join("k")
+    follower, is_leader = flight.join("k")
+    assert leader and not is_leader and follower is future
+    future.cancel()
+    flight.finish("k", future, "result")
+    # The key is free again, and a stale finish doesn't drop a newer flight
+    newer, leader = flight.join("k")
+    assert leader
+    flight.finish("k", future, error=RuntimeError())
+    assert flight.join("k") == (newer, False)
@@ -0,0 +1,79 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+
+@pytest.fixture
+def journals(sai_api, tmp_path):
+    # Two live processes sharing one journal file; the parent of the test run
+    # stands in for the other process
+    import importlib
+    journal = importlib.import_module("sai_api.journal")
+    path = str(tmp_path / "jobs.sqlite3")
+
+    def open_journal(owner, **kwargs):
+        return journal.JobJournal(path, owner=f"{journal._HOST}:{owner}", **kwargs)
+
+    return journal, open_journal
+
+
+def test_a_pending_generation_is_claimed_once(journals):
+    journal, open_journal = journals
+    a, b = open_journal(f"{os.getppid()}:a"), open_journal(f"{os.getppid()}:b")
+    a.record("payload", "key", "endpoint", "gen-1")
+    assert a.resume("payload", ["key"]) == (None, None)
+    assert b.resume("payload", ["key"]) == (None, None)
+    a.release("gen-1")
+    assert b.resume("payload", ["key"]) == ("gen-1", "key")
+    assert a.resume("payload", ["key"]) == (None, None)
+
+
+def test_completed_generations_are_not_resumed(journals):
+    journal, open_journal = journals
+    a, b = open_journal(f"{os.getppid()}:a"), open_journal(f"{os.getppid()}:b")
+    a.record("payload", "key", "endpoint", "gen-1")
+    a.complete("gen-1")
+    assert b.resume("payload", ["key"]) == (None, None)
+
+
+def test_release_only_drops_the_callers_claim(journals):
+    journal, open_journal = journals
+    a, b = open_journal(f"{os.getppid()}:a"), open_journal(f"{os.getppid()}:b")
+    a.record("payload", "key", "endpoint", "gen-1")
+    b.release("gen-1")
+    assert b.resume("payload", ["key"]) == (None, None)
+
+
+def test_an_expired_claim_can_be_taken_over(journals):
+    journal, open_journal = journals
+    a = open_journal("1:a", claim_seconds=-1)
+    b = open_journal(f"{os.getppid()}:b")
+    a.record("payload", "key", "endpoint", "gen-1")
+    assert b.resume("payload", ["key"]) == ("gen-1", "key")
+
+
+@pytest.mark.skipif(os.name != "posix", reason="exited processes are only detected on POSIX")
+def test_a_claim_by_an_exited_process_can_be_taken_over(journals):
+    journal, open_journal = journals
+    exited = subprocess.Popen([sys.executable, "-c", "pass"])
+    exited.wait()
+    a = open_journal(f"{exited.pid}:a")
+    b = open_journal(f"{os.getppid()}:b")
+    a.record("payload", "key", "endpoint", "gen-1")
+    assert b.resume("payload", ["key"]) == ("gen-1", "key")
+
+
+def test_claims_are_added_to_an_older_journal(journals, tmp_path):
+    import sqlite3
+    journal, _ = journals
+    path = str(tmp_path / "old.sqlite3")
+    db = sqlite3.connect(path)
+    db.execute("CREATE TABLE jobs (generation_id TEXT PRIMARY KEY, payload TEXT NOT NULL, account TEXT NOT NULL, endpoint TEXT NOT NULL, submitted REAL NOT NULL, completed REAL)")
+    db.commit()
+    db.close()
+    old = journal.JobJournal(path)
+    old.record("payload", "key", "endpoint", "gen-1")
+    old.release("gen-1")
+    assert old.resume("payload", ["key"]) == ("gen-1", "key")
@@ -0,0 +1,108 @@
+import importlib
+
+import pytest
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def keys(sai_api, monkeypatch):
+    keys = importlib.import_module("sai_api.keys")
+    clock = Clock()
+    monkeypatch.setattr(keys, "time", clock)
+    keys.clock = clock
+    return keys
+
+
+def take(pool, count):
+    picked = []
+    for _ in range(count):
+        api_key = pool.acquire(max_wait=0)
+        pool.release(api_key, 200)
+        picked.append(api_key)
+    return picked
+
+
+def test_weighted_round_robin_follows_the_weights(keys):
+    pool = keys.KeyPool([("sk-aaaa1111", 2.0), ("sk-bbbb2222", 1.0)], strategy="weighted")
+    # Smooth: the lighter key is interleaved rather than sent a run of requests
+    a, b = "sk-aaaa1111", "sk-bbbb2222"
+    assert take(pool, 6) == [a, b, a, a, b, a]
+
+
+def test_least_outstanding_spreads_concurrent_requests(keys):
+    pool = keys.KeyPool([("sk-aaaa1111", 1.0), ("sk-bbbb2222", 1.0)])
+    first, second = pool.acquire(max_wait=0), pool.acquire(max_wait=0)
+    assert {first, second} == {"sk-aaaa1111", "sk-bbbb2222"}
+    pool.release(first, 200)
+    assert pool.acquire(max_wait=0) == first
+
+
+def test_unknown_strategy_is_rejected(keys):
+    with pytest.raises(Exception, match="SAI_API_KEY_STRATEGY"):
+        keys.KeyPool([("sk-aaaa1111", 1.0)], strategy="random")
+
+
+def test_throttled_key_is_ejected_for_retry_after(keys):
+    pool = keys.KeyPool([("sk-aaaa1111", 1.0), ("sk-bbbb2222", 1.0)])
+    api_key = pool.acquire(max_wait=0)
+    pool.release(api_key, 429, delay=5)
+    other = "sk-bbbb2222" if api_key == "sk-aaaa1111" else "sk-aaaa1111"
+    assert take(pool, 3) == [other] * 3
+    assert pool.stats()[keys.label(api_key)]["state"] == "ejected"
+    keys.clock.now += 5
+    assert api_key in take(pool, 2)
+    assert pool.stats()[keys.label(api_key)]["state"] == "active"
+
+
+def test_only_one_probe_after_an_ejection(keys):
+    pool = keys.KeyPool([("sk-aaaa1111", 1.0)])
+    pool.release(pool.acquire(max_wait=0), 429, delay=1)
+    keys.clock.now += 1
+    probe = pool.acquire(max_wait=0)
+    assert pool.stats()[keys.label(probe)]["state"] == "probing"
+    with pytest.raises(Exception, match="Every pooled API key is unavailable"):
+        pool.acquire(max_wait=0)
+    pool.release(probe, 200)
+    assert pool.acquire(max_wait=0) == "sk-aaaa1111"
+
+
+def test_failed_probes_double_the_ejection(keys, monkeypatch):
+    monkeypatch.setattr(keys, "KEY_EJECT_SECONDS", 10)
+    monkeypatch.setattr(keys, "KEY_EJECT_MAX", 35)
+    pool = keys.KeyPool([("sk-aaaa1111", 1.0)])
+    pool.release(pool.acquire(max_wait=0), 401)
+    ejections = []
+    for _ in range(4):
+        ejected_for = pool.stats()["...1111"]["ejected_for"]
+        ejections.append(ejected_for)
+        keys.clock.now += ejected_for
+        pool.release(pool.acquire(max_wait=0), 402)
+    assert ejections == [10, 20, 35, 35]
+
+
+def test_a_successful_probe_resets_the_backoff(keys, monkeypatch):
+    monkeypatch.setattr(keys, "KEY_EJECT_SECONDS", 10)
+    pool = keys.KeyPool([("sk-aaaa1111", 1.0)])
+    pool.release(pool.acquire(max_wait=0), 401)
+    keys.clock.now += 10
+    pool.release(pool.acquire(max_wait=0), 200)
+    pool.release(pool.acquire(max_wait=0), 401)
+    assert pool.stats()["...1111"]["ejected_for"] == 10
+
+
+def test_server_errors_do_not_eject(keys):
+    pool = keys.KeyPool([("sk-aaaa1111", 1.0)])
+    pool.release(pool.acquire(max_wait=0), 500)
+    pool.release(pool.acquire(max_wait=0), None)
+    assert pool.stats()["...1111"]["state"] == "active"
+
+
+def test_parse_keys_reads_weights_and_skips_comments(keys):
+    assert keys.parse_keys("a, b:2\n# note\n c : 0.5 ") == [("a", 1.0), ("b", 2.0), ("c", 0.5)]
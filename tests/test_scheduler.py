@@ -0,0 +1,131 @@
+import importlib
+
+import pytest
+
+pytest.importorskip("requests")
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class Response:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def scheduler(sai_api, monkeypatch):
+    scheduler = importlib.import_module("sai_api.scheduler")
+    clock = Clock()
+    monkeypatch.setattr(scheduler, "time", clock)
+    scheduler.clock = clock
+    return scheduler
+
+
+def open_breaker(scheduler, threshold=2, cooldown=30):
+    breaker = scheduler.CircuitBreaker(threshold=threshold, cooldown=cooldown)
+    for _ in range(threshold):
+        breaker.record_failure()
+    return breaker
+
+
+def test_breaker_opens_after_consecutive_failures(scheduler):
+    breaker = scheduler.CircuitBreaker(threshold=3, cooldown=30)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.allow() is False
+    breaker.record_failure()
+    with pytest.raises(Exception, match="Service unavailable"):
+        breaker.allow()
+
+
+def test_one_probe_after_the_cooldown(scheduler):
+    breaker = open_breaker(scheduler)
+    scheduler.clock.now += 30
+    assert breaker.allow() is True
+    with pytest.raises(Exception, match="Service unavailable"):
+        breaker.allow()
+    breaker.record_success()
+    assert breaker.allow() is False
+
+
+def test_a_failed_probe_reopens_the_breaker(scheduler):
+    breaker = open_breaker(scheduler, threshold=5)
+    scheduler.clock.now += 30
+    assert breaker.allow() is True
+    breaker.record_failure()
+    with pytest.raises(Exception, match="Service unavailable"):
+        breaker.allow()
+    scheduler.clock.now += 30
+    assert breaker.allow() is True
+
+
+def test_an_inconclusive_probe_lets_the_next_request_probe(scheduler):
+    breaker = open_breaker(scheduler)
+    scheduler.clock.now += 30
+    assert breaker.allow() is True
+    breaker.end_probe()
+    assert breaker.allow() is True
+
+
+def test_a_probe_that_raises_is_ended(scheduler):
+    requests = scheduler.RequestScheduler()
+    requests.breaker = open_breaker(scheduler)
+    scheduler.clock.now += 30
+
+    def send():
+        raise ValueError("not a transport error")
+
+    with pytest.raises(ValueError):
+        requests.request("key", send)
+    assert requests.breaker.probing is False
+    assert requests.breaker.allow() is True
+
+
+@pytest.mark.parametrize("status,idempotent,sends", [
+    (429, False, 2),
+    (503, False, 2),
+    (502, False, 1),
+    (504, False, 1),
+    (502, True, 2),
+])
+def test_which_responses_are_sent_again(scheduler, status, idempotent, sends):
+    requests = scheduler.RequestScheduler()
+    responses = [Response(status), Response(200)]
+    sent = []
+
+    def send():
+        sent.append(1)
+        return responses[len(sent) - 1]
+
+    response = requests.request("key", send, idempotent=idempotent)
+    assert len(sent) == sends
+    assert response.status_code == (200 if sends == 2 else status)
+
+
+def test_token_bucket_reports_the_wait(scheduler):
+    bucket = scheduler.TokenBucket(rate=2, capacity=1)
+    assert bucket.try_acquire() == 0.0
+    assert bucket.try_acquire() == pytest.approx(0.5)
+    scheduler.clock.now += 0.5
+    assert bucket.try_acquire() == 0.0
+    bucket.defer(3)
+    assert bucket.try_acquire() == pytest.approx(3)
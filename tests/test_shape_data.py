@@ -0,0 +1,40 @@
+import sys
+
+SD3 = "stable-image/generate/sd3"
+RELIGHT = "stable-image/edit/replace-background-and-relight"
+
+
+def shape_data(*args):
+    return sys.modules["sai_api.client"].shape_data(*args)
+
+
+def test_sd3_models_drop_the_style_preset(sai_api):
+    data = shape_data(SD3, {"model": "sd3-medium", "style_preset": "anime", "negative_prompt": "x"}, {})
+    assert "style_preset" not in data
+    assert data["negative_prompt"] == "x"
+
+
+def test_sd35_models_keep_the_style_preset(sai_api):
+    data = shape_data(SD3, {"model": "sd3.5-large", "style_preset": "anime"}, {})
+    assert data["style_preset"] == "anime"
+
+
+def test_large_turbo_drops_the_negative_prompt(sai_api):
+    data = shape_data(SD3, {"model": "sd3-large-turbo", "negative_prompt": "x"}, {})
+    assert "negative_prompt" not in data
+
+
+def test_other_routes_keep_the_style_preset(sai_api):
+    data = {"style_preset": "anime", "negative_prompt": "x"}
+    assert shape_data("stable-image/generate/core", dict(data), {}) == data
+
+
+def test_relight_without_light_reference(sai_api):
+    data = shape_data(RELIGHT, {"subject_image": "tensor", "light_source_direction": "none", "light_source_strength": 0.3}, {"subject_image": b"png"})
+    assert data == {"light_source_direction": "none"}
+
+
+def test_relight_with_light_reference(sai_api):
+    files = {"subject_image": b"png", "light_reference": b"png"}
+    data = shape_data(RELIGHT, {"light_reference": "tensor", "light_source_direction": "left", "light_source_strength": 0.3}, files)
+    assert data == {"light_source_strength": 0.3}
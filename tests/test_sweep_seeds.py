@@ -0,0 +1,36 @@
+import sys
+
+import pytest
+
+
+def parse_seeds(*args):
+    return sys.modules["sai_api.stability_api"].parse_seeds(*args)
+
+
+def test_seeds_and_ranges(sai_api):
+    assert parse_seeds("1-4, 10") == [1, 2, 3, 4, 10]
+    assert parse_seeds(" 7 ") == [7]
+    assert parse_seeds("") == []
+
+
+def test_huge_range_is_rejected_before_it_is_expanded(sai_api):
+    with pytest.raises(Exception, match="4294967295 seeds"):
+        parse_seeds("0-4294967294", 256)
+
+
+def test_ranges_count_together_against_the_limit(sai_api):
+    assert len(parse_seeds("1-3, 10-12", 6)) == 6
+    with pytest.raises(Exception, match="SAI_API_SWEEP_MAX"):
+        parse_seeds("1-3, 10-13", 6)
+
+
+@pytest.mark.parametrize("text,message", [
+    ("4-1", "reversed"),
+    ("4294967295", "outside"),
+    ("1-4294967295", "outside"),
+    ("-3", "Can't read"),
+    ("abc", "Can't read"),
+])
+def test_bad_seeds_are_rejected(sai_api, text, message):
+    with pytest.raises(Exception, match=message):
+        parse_seeds(text)
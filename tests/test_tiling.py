@@ -0,0 +1,65 @@
+import importlib.util
+import os
+
+import pytest
+
+torch = pytest.importorskip("torch")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+_spec = importlib.util.spec_from_file_location("sai_api_tiling", os.path.join(ROOT, "tiling.py"))
+tiling = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(tiling)
+
+
+def upscale_nearest(view, scale):
+    # Stand-in for the API: nearest neighbour upscale of one tile
+    return view.repeat_interleave(scale, dim=1).repeat_interleave(scale, dim=2)
+
+
+def run_tiled(image, tile, overlap, scale):
+    _, height, width, _ = image.shape
+    tiles = [
+        (y, x, view.shape[1], view.shape[2], upscale_nearest(view, scale))
+        for y, x, view in tiling.split_tiles(image, tile, overlap)
+    ]
+    return tiling.stitch(tiles, height, width, scale, overlap)
+
+
+@pytest.mark.parametrize("height,width,tile,overlap", [(300, 200, 128, 32), (512, 512, 256, 64), (100, 90, 128, 16)])
+def test_tile_starts_cover_the_image(height, width, tile, overlap):
+    for length in (height, width):
+        starts = tiling.tile_starts(length, tile, overlap)
+        assert starts[0] == 0
+        assert starts[-1] + min(tile, length) == length
+        for a, b in zip(starts, starts[1:]):
+            assert b - a <= tile - overlap
+
+
+def test_overlap_must_be_smaller_than_tile():
+    with pytest.raises(Exception, match="tile_overlap"):
+        tiling.tile_starts(4096, 256, 512)
+    with pytest.raises(Exception, match="tile_overlap"):
+        tiling.tile_count(4096, 4096, 256, 256)
+
+
+@pytest.mark.parametrize("scale", [1, 2])
+def test_stitch_matches_whole_image_upscale(scale):
+    torch.manual_seed(0)
+    image = torch.rand((1, 300, 200, 3))
+    out = run_tiled(image, 128, 32, scale)
+    assert out.shape == (1, 300 * scale, 200 * scale, 3)
+    # Every tile agrees with the whole-image result, so any seam shows up as a difference
+    torch.testing.assert_close(out, upscale_nearest(image, scale), atol=1e-5, rtol=0)
+
+
+def test_stitch_without_overlap():
+    image = torch.rand((1, 256, 256, 3))
+    out = run_tiled(image, 128, 0, 2)
+    torch.testing.assert_close(out, upscale_nearest(image, 2), atol=1e-5, rtol=0)
+
+
+def test_stitch_keeps_uint8():
+    image = (torch.rand((1, 200, 160, 3)) * 255).to(torch.uint8)
+    out = run_tiled(image, 96, 24, 2)
+    assert out.dtype == torch.uint8
+    assert torch.equal(out, upscale_nearest(image, 2))
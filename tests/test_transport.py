@@ -0,0 +1,44 @@
+import importlib
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+pytest.importorskip("requests")
+pytest.importorskip("numpy")
+pytest.importorskip("PIL")
+
+from mock_server import MockConfig, MockStabilityServer
+
+CORE = "stable-image/generate/core"
+
+
+@pytest.fixture
+def server(sai_api, monkeypatch):
+    client = importlib.import_module("sai_api.client")
+    transport = importlib.import_module("sai_api.transport")
+    server = MockStabilityServer(MockConfig(latency=0.01, jitter=0.0)).start()
+    monkeypatch.setattr(client, "ROOT_API", server.url)
+    defaults = (transport.POOL_CONNECTIONS, transport.POOL_MAXSIZE, transport.POOL_BLOCK)
+    yield server
+    server.stop()
+    transport.configure_transport(*defaults)
+
+
+def test_connections_are_reused(server):
+    client = importlib.import_module("sai_api.client")
+    metrics = importlib.import_module("sai_api.metrics")
+    transport = importlib.import_module("sai_api.transport")
+    transport.configure_transport(pool_maxsize=2, pool_block=True)
+    transport.reset_transport_stats()
+
+    def call(_):
+        headers = {"Authorization": "mock-key", "Accept": "image/*"}
+        return client.send(CORE, headers, {"prompt": "a lighthouse"}, {"none": None}, metrics.CallMetrics(CORE))
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        results = list(pool.map(call, range(12)))
+    assert all(content.startswith(b"\x89PNG") for content in results)
+    stats = transport.transport_stats()
+    assert stats["requests"] == 12
+    assert stats["connections_reused"] > 0
+    assert stats["connections_opened"] <= 2
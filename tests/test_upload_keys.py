@@ -0,0 +1,72 @@
+import sys
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("numpy")
+pytest.importorskip("PIL")
+
+
+@pytest.fixture
+def node(sai_api, monkeypatch):
+    stability_api = sys.modules["sai_api.stability_api"]
+    payloads = sys.modules["sai_api.payloads"]
+    cache = payloads.PayloadCache(1024 ** 2)
+    monkeypatch.setattr(stability_api, "get_payload_cache", lambda: cache)
+
+    class Node(stability_api.StabilityConservativeUpscale):
+        # Stand-in encoder, the key must not depend on what it produces
+        def _encode(self, tensor, fp=None, format=None):
+            encoded = b"encoded-" + bytes(f"{tuple(tensor.shape)}-{format}", "ascii")
+            if fp is None:
+                return encoded
+            fp.write(encoded)
+            return fp
+
+    return Node()
+
+
+def key(upload):
+    request_key = sys.modules["sai_api.cache"].request_key
+    return request_key("stable-image/upscale/conservative", "image/*", {"prompt": "a", "seed": 1}, {"image": upload})
+
+
+def test_request_key_is_the_same_after_a_memo_hit(node):
+    multipart = sys.modules["sai_api.multipart"]
+    image = torch.rand(1, 64, 48, 3)
+    first = node._upload(image)
+    assert isinstance(first, multipart.LazyUpload)
+    before = key(first)
+    # Sending the streamed upload remembers the encoded bytes
+    b"".join(first.chunks())
+    second = node._upload(image.clone())
+    assert isinstance(second, multipart.EncodedUpload)
+    assert key(second) == before
+
+
+def test_request_key_is_the_same_without_streaming(node, monkeypatch):
+    stability_api = sys.modules["sai_api.stability_api"]
+    image = torch.rand(1, 64, 48, 3)
+    streamed = key(node._upload(image))
+    monkeypatch.setattr(stability_api, "STREAM_UPLOAD", False)
+    assert key(node._upload(image)) == streamed
+    assert key(node._upload(image)) == streamed
+
+
+def test_fingerprint_hashes_the_quantized_pixels(sai_api):
+    import importlib
+    encoder = importlib.import_module("sai_api.encoder")
+    pixels = torch.randint(0, 256, (1, 32, 40, 3), dtype=torch.uint8)
+    image = pixels.float() / 255
+    assert encoder.tensor_fingerprint(image, "png") == encoder.tensor_fingerprint(pixels, "png")
+    assert encoder.tensor_fingerprint(image, "png") != encoder.tensor_fingerprint(image, "jpeg")
+
+
+def test_upload_format_input_changes_the_upload_and_its_key(node, monkeypatch):
+    stability_api = sys.modules["sai_api.stability_api"]
+    monkeypatch.setattr(stability_api, "STREAM_UPLOAD", False)
+    image = torch.rand(1, 64, 48, 3)
+    default, jpeg = node._upload(image), node._upload(image, "jpeg")
+    assert jpeg.content.endswith(b"-jpeg")
+    assert key(jpeg) != key(default)
+    assert key(node._upload(image, "default")) == key(default)
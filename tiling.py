@@ -0,0 +1,74 @@
+import math
+
+import torch
+import torch.nn.functional as F
+
+
+def tile_starts(length, tile, overlap):
+    # Fewest full-size tiles that overlap by at least `overlap`, spread evenly
+    if overlap >= tile:
+        raise Exception(f"Stability API Error: Bad request.\n\ntile_overlap ({overlap}) must be smaller than tile_size ({tile})")
+    if length <= tile:
+        return [0]
+    count = math.ceil((length - overlap) / (tile - overlap))
+    return [round(i * (length - tile) / (count - 1)) for i in range(count)]
+
+
+def tile_count(height, width, tile, overlap):
+    return len(tile_starts(height, tile, overlap)) * len(tile_starts(width, tile, overlap))
+
+
+def split_tiles(image, tile, overlap):
+    # image is [1,H,W,C]; returns (y, x, view) for overlapping tiles covering it
+    _, h, w, _ = image.shape
+    return [
+        (y, x, image[:, y:y + tile, x:x + tile, :])
+        for y in tile_starts(h, tile, overlap)
+        for x in tile_starts(w, tile, overlap)
+    ]
+
+
+def resize(image, height, width):
+    # [B,H,W,C] -> [B,height,width,C]
+    if image.shape[1] == height and image.shape[2] == width:
+        return image
+    antialias = height < image.shape[1] or width < image.shape[2]
+    out = F.interpolate(image.movedim(-1, 1).float(), size=(height, width), mode="bilinear", align_corners=False, antialias=antialias)
+    return out.movedim(1, -1).to(image.dtype)
+
+
+def _ramp(length, before, after):
+    weights = torch.ones(length)
+    if before > 0:
+        n = min(before, length)
+        weights[:n] = (torch.arange(n) + 0.5) / n
+    if after > 0:
+        n = min(after, length)
+        weights[length - n:] = torch.minimum(weights[length - n:], ((torch.arange(n) + 0.5) / n).flip(0))
+    return weights
+
+
+def stitch(tiles, height, width, scale, overlap):
+    # tiles is a list of (y, x, h, w, result) in input coordinates; results are
+    # resized onto the output grid and feather blended across the overlaps
+    out_h, out_w = round(height * scale), round(width * scale)
+    channels = min(t[4].shape[-1] for t in tiles)
+    ramp = max(1, round(overlap * scale)) if overlap > 0 else 0
+    acc = torch.zeros((out_h, out_w, channels), dtype=torch.float32)
+    total = torch.zeros((out_h, out_w, 1), dtype=torch.float32)
+
+    for y, x, h, w, result in tiles:
+        oy, ox = round(y * scale), round(x * scale)
+        oh, ow = round((y + h) * scale) - oy, round((x + w) * scale) - ox
+        result = resize(result[..., :channels].float(), oh, ow)[0]
+        wy = _ramp(oh, ramp if y > 0 else 0, ramp if y + h < height else 0)
+        wx = _ramp(ow, ramp if x > 0 else 0, ramp if x + w < width else 0)
+        weight = (wy[:, None] * wx[None, :])[..., None]
+        acc[oy:oy + oh, ox:ox + ow] += result * weight
+        total[oy:oy + oh, ox:ox + ow] += weight
+
+    out = acc.div_(total.clamp_min(1e-6))
+    dtype = tiles[0][4].dtype
+    if dtype == torch.uint8:
+        out = out.round_().clamp_(0, 255)
+    return out.to(dtype)[None]
@@ -0,0 +1,88 @@
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+POOL_CONNECTIONS = int(os.environ.get("SAI_API_POOL_CONNECTIONS", 4))
+POOL_MAXSIZE = int(os.environ.get("SAI_API_POOL_MAXSIZE", 16))
+POOL_BLOCK = os.environ.get("SAI_API_POOL_BLOCK", "0").lower() in ("1", "true", "yes")
+
+_lock = threading.Lock()
+_session = None
+_stats = {"requests": 0, "connections_opened": 0}
+
+
+def _count(name):
+    with _lock:
+        _stats[name] += 1
+
+
+class _CountingHTTPConnectionPool(HTTPConnectionPool):
+    def _new_conn(self):
+        _count("connections_opened")
+        return super()._new_conn()
+
+
+class _CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    def _new_conn(self):
+        _count("connections_opened")
+        return super()._new_conn()
+
+
+class PooledAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _CountingHTTPConnectionPool,
+            "https": _CountingHTTPSConnectionPool,
+        }
+
+    def send(self, request, **kwargs):
+        _count("requests")
+        return super().send(request, **kwargs)
+
+
+def _new_session(pool_connections, pool_maxsize, pool_block):
+    session = requests.Session()
+    adapter = PooledAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, pool_block=pool_block)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session():
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                _session = _new_session(POOL_CONNECTIONS, POOL_MAXSIZE, POOL_BLOCK)
+    return _session
+
+
+def configure_transport(pool_connections=None, pool_maxsize=None, pool_block=None):
+    global _session, POOL_CONNECTIONS, POOL_MAXSIZE, POOL_BLOCK
+    with _lock:
+        if pool_connections is not None:
+            POOL_CONNECTIONS = pool_connections
+        if pool_maxsize is not None:
+            POOL_MAXSIZE = pool_maxsize
+        if pool_block is not None:
+            POOL_BLOCK = pool_block
+        old, _session = _session, _new_session(POOL_CONNECTIONS, POOL_MAXSIZE, POOL_BLOCK)
+    if old is not None:
+        old.close()
+
+
+def transport_stats():
+    with _lock:
+        stats = dict(_stats)
+    stats["connections_reused"] = max(0, stats["requests"] - stats["connections_opened"])
+    return stats
+
+
+def reset_transport_stats():
+    with _lock:
+        for k in _stats:
+            _stats[k] = 0